@@ -0,0 +1,107 @@
+'''Micro-benchmarks for staticpy.page.reader
+
+Compares Reader.read with the line by line parser it replaced, on pages
+with growing bodies.
+
+usage: python -m benchmarks.reader
+'''
+from __future__ import absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+import timeit
+
+from staticpy.page.data import Data
+from staticpy.page.reader import Reader, _cast
+
+LEGACY_NAME_REGEX = re.compile(
+    r'^:(?P<attribute>[a-z\-_]+)'
+    r'(?:\[(?P<type>[a-z]+)\])?:'
+    r'\s*(?P<value>.*)$'
+)
+
+
+def legacy_read(path):
+    '''The readlines, regex per line and value += line parser'''
+    output = Data()
+
+    with open(path) as fp:
+        lines = fp.readlines()
+
+    attribute, value, data_type = '', '', None
+    for line in lines:
+        data = LEGACY_NAME_REGEX.match(line)
+        if data:
+            if value:
+                output.set(attribute, _cast(value, data_type))
+
+            attribute = data.group('attribute')
+            value = data.group('value')
+            data_type = data.group('type')
+        else:
+            value += line
+    output.set(attribute, _cast(value, data_type))
+    return output
+
+
+def page_contents(body_lines):
+    header = (
+        ':title: A Page\n:published: 1\n:order: 3\n'
+        ':tags[list]:\n  a\n  b\n'
+    )
+    body = ''.join(
+        '  <tr><td>row %s</td><td>some generated data</td></tr>\n' % i
+        for i in xrange(body_lines)
+    )
+    return header + ':content:\n' + body
+
+
+def bench(path, repeat=5, number=20):
+    def best(func):
+        return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+    def read():
+        Reader().read(path).content
+
+    return {
+        'legacy': best(lambda: legacy_read(path)),
+        'reader': best(read),
+        'metadata': best(lambda: Reader().read(path).title),
+    }
+
+
+def run(sizes=(10, 1000, 10000, 50000)):
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for size in sizes:
+            path = os.path.join(directory, '%s.page' % size)
+            with open(path, 'w') as fp:
+                fp.write(page_contents(size))
+            assert Reader().read(path).content == legacy_read(path).content
+            # Small pages take microseconds, time enough reads of them to
+            # rise above the timer's noise
+            results[size] = bench(path, number=max(20, 100000 // size))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main():
+    print '%8s %12s %12s %8s %14s' % (
+        'lines', 'legacy (ms)', 'reader (ms)', 'speedup', 'metadata (ms)',
+    )
+    for size, timings in sorted(run().items()):
+        print '%8s %12.3f %12.3f %7.1fx %14.3f' % (
+            size,
+            timings['legacy'] * 1000,
+            timings['reader'] * 1000,
+            timings['legacy'] / timings['reader'],
+            timings['metadata'] * 1000,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+'''Benchmark staticpy builds on synthetic sites
+
+Each site size is generated and built in its own process so its peak
+memory can be measured, the phases of the build are timed separately:
+
+    scan: walking the pages directory
+    parse: building the page tree and reading every page's metadata
+    build: rendering and writing every page and the sitemap
+    rebuild: a second build of the unchanged site
+
+Micro-benchmarks for the reader, cached_property, Category.sub_pages and
+Page.prev/next run on a site of the first size.  Results are printed, or
+written to --output, as json.
+
+usage: python -m benchmarks.run --pages 1000 10000 100000
+'''
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import timeit
+import traceback
+from Queue import Empty
+from datetime import datetime
+from multiprocessing import Process, Queue
+
+from .synthetic import generate_site
+
+
+def _timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def _peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _new_site(path, page_size):
+    from staticpy.category import Category
+    from staticpy.site import Site
+    from staticpy.utils import init_output_dir, load_settings
+
+    Category._page_size = page_size
+    settings = load_settings(path)
+    init_output_dir(path, settings.output_path)
+    return Site(settings)
+
+
+def build_site(options):
+    '''Generate and build one synthetic site, in a child process'''
+    directory = tempfile.mkdtemp()
+    try:
+        path = generate_site(
+            os.path.join(directory, 'site'),
+            pages=options['pages'],
+            depth=options['depth'],
+            branches=options['branches'],
+            body_lines=options['body_lines'],
+        )
+        site = _new_site(path, options['page_size'])
+        phases = {}
+        phases['scan'], _ = _timed(lambda: site.tree)
+        phases['parse'], pages = _timed(lambda: site.pages)
+        phases['build'], _ = _timed(lambda: site.save(options['jobs']))
+
+        site = _new_site(path, options['page_size'])
+        phases['rebuild'], _ = _timed(lambda: site.save(options['jobs']))
+        return {
+            'options': options,
+            'rendered_pages': len(pages),
+            'phases': phases,
+            'peak_memory_kb': _peak_memory_kb(),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+def _best(func, repeat=5, number=1):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def micro_benchmarks(options):
+    '''Time the hot spots of a build on one synthetic site'''
+    from staticpy.utils import cached_property
+
+    from .reader import bench as bench_reader, page_contents
+
+    directory = tempfile.mkdtemp()
+    try:
+        page = os.path.join(directory, 'large.page')
+        with open(page, 'w') as fp:
+            fp.write(page_contents(10000))
+        results = {'reader_10k_lines': bench_reader(page)}
+
+        class Cached(object):
+            _cache = None
+
+            @cached_property
+            def value(self):
+                return 1
+
+        instance = Cached()
+        results['cached_property_hit'] = _best(
+            lambda: instance.value, number=100000,
+        )
+
+        path = generate_site(
+            os.path.join(directory, 'site'),
+            pages=options['pages'],
+            depth=options['depth'],
+            branches=options['branches'],
+            body_lines=options['body_lines'],
+        )
+        site = _new_site(path, options['page_size'])
+        pages = site.pages
+        categories = [site.base] + site.categories
+
+        def forget(instance, *names):
+            for name in names:
+                (instance._cache or {}).pop(name, None)
+
+        def sub_pages():
+            for category in categories:
+                forget(category, 'sub_pages')
+            site.base.sub_pages
+
+        def prev_next():
+            for page in pages:
+                forget(page, 'prev', 'next')
+                page.prev
+                page.next
+
+        results['category_sub_pages'] = _best(sub_pages)
+        results['page_prev_next_all_pages'] = _best(prev_next)
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def _report(queue, func, args):
+    try:
+        queue.put((True, func(*args)))
+    except Exception:
+        queue.put((False, traceback.format_exc()))
+
+
+def _in_child_process(func, *args):
+    '''Run func in a new process, so its peak memory is its own
+
+    A plain Process rather than a Pool worker: pool workers are daemonic,
+    and daemonic processes can not start the workers of site.save(jobs).
+    '''
+    queue = Queue()
+    process = Process(target=_report, args=(queue, func, args))
+    process.start()
+    try:
+        while True:
+            try:
+                succeeded, result = queue.get(timeout=1)
+                break
+            except Empty:
+                if not process.is_alive():
+                    raise RuntimeError(
+                        'Benchmark process exited with %s' % process.exitcode
+                    )
+    finally:
+        process.join()
+
+    if not succeeded:
+        raise RuntimeError('Benchmark failed:\n' + result)
+    return result
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[1000])
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--branches', type=int, default=3)
+    parser.add_argument('--body-lines', type=int, default=50)
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=5,
+        help='The number of children listed per index page',
+    )
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--no-micro', action='store_true')
+    parser.add_argument('--output', help='Write the json results here')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'sites': [],
+    }
+    for pages in args.pages:
+        options = {
+            'pages': pages,
+            'depth': args.depth,
+            'branches': args.branches,
+            'body_lines': args.body_lines,
+            'page_size': args.page_size,
+            'jobs': args.jobs,
+        }
+        results['sites'].append(_in_child_process(build_site, options))
+        if not args.no_micro and 'micro' not in results:
+            results['micro'] = _in_child_process(micro_benchmarks, options)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+'''Generate synthetic staticpy sites for benchmarking
+
+Sites are built from the repository's template/ skeleton: its templates
+are copied and the pages directory is filled with a tree of categories
+and generated pages.
+'''
+from __future__ import absolute_import
+
+import os
+import shutil
+
+SKELETON = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'template',
+)
+
+INDEX_PAGE = ''':title: {title}
+:include_in_navigation: {navigation}
+:published: 1
+
+:content:
+  Listing of {title}
+'''
+
+PAGE = ''':title: {title}
+:published: 1
+:order: {order}
+:meta-description: A generated page
+:description:
+  A generated page, number {number}
+
+:content:
+{body}
+'''
+
+
+def _body(lines):
+    return ''.join(
+        '  <p>Paragraph {0} of a generated page body.</p>\n'.format(i)
+        for i in xrange(lines)
+    )
+
+
+def _category_paths(root, depth, branches):
+    paths = [root]
+    level = [root]
+    for _ in xrange(depth):
+        level = [
+            os.path.join(parent, 'category_%s' % n)
+            for parent in level
+            for n in xrange(branches)
+        ]
+        paths.extend(level)
+    return paths
+
+
+def generate_site(path, pages=1000, depth=2, branches=3, body_lines=50):
+    '''Write a synthetic site to path
+
+    params:
+        pages: the number of (non index) pages
+        depth: how many levels of categories below the root
+        branches: the number of sub categories in each category
+        body_lines: the number of lines in each page's content
+    returns: path
+    '''
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    shutil.copytree(
+        os.path.join(SKELETON, 'dynamic', 'templates'),
+        os.path.join(path, 'dynamic', 'templates'),
+    )
+    open(os.path.join(path, 'dynamic', '__init__.py'), 'w').close()
+    os.makedirs(os.path.join(path, 'static'))
+
+    root = os.path.join(path, 'dynamic', 'pages')
+    depth_one = root.count(os.sep) + 1
+    categories = _category_paths(root, depth, branches)
+    for category in categories:
+        if not os.path.isdir(category):
+            os.makedirs(category)
+        with open(os.path.join(category, 'index.page'), 'w') as fp:
+            fp.write(INDEX_PAGE.format(
+                title=os.path.basename(category),
+                navigation='True' if category.count(os.sep) <= depth_one
+                else '',
+            ))
+
+    body = _body(body_lines)
+    for n in xrange(pages):
+        category = categories[n % len(categories)]
+        with open(os.path.join(category, 'page_%s.page' % n), 'w') as fp:
+            fp.write(PAGE.format(
+                title='Page %s' % n,
+                order=n,
+                number=n,
+                body=body,
+            ))
+    return path
@@ -16,6 +16,7 @@ setup(
         'jinja2',
         'watchdog',
         'boto',
+        'scandir; python_version < "3.5"',
     ],
 )
 
@@ -5,11 +5,7 @@ import os
 from ..page import Page
 from .index_page import IndexPage
 
-from ..utils import (
-    cached_property,
-    list_directories,
-    list_files,
-)
+from ..utils import cached_property
 
 
 class Category(object):
@@ -55,7 +51,7 @@ class Category(object):
 
     @cached_property
     def categories(self):
-        paths = [p for p in list_directories(self.path)]
+        paths = self.site.tree.directories(self.path)
         return [Category(self.site, p) for p in paths]
 
     @cached_property
@@ -84,13 +80,30 @@ class Category(object):
             pages = [p for p in pages if p.published]
         return sorted(pages, key=lambda x: x.order)
 
+    @cached_property
+    def _positions(self):
+        return dict((page, n) for n, page in enumerate(self.children))
+
+    def neighbour(self, page, offset):
+        '''Find the child offset places away from page in children
+
+        returns: a page, or None if there is none or page is not a child
+        '''
+        position = self._positions.get(page)
+        if position is None:
+            return None
+
+        position += offset
+        if 0 <= position < self.child_count:
+            return self.children[position]
+
     @cached_property
     def _paged_children(self):
         for i in xrange(0, self.child_count, self._page_size):
             yield self.children[i:i+self._page_size]
 
     def _generate_child_pages(self):
-        paths = (p for p in list_files(self.path)
+        paths = (p for p in self.site.tree.files(self.path)
                  if p.endswith('.page') and not p.endswith('index.page'))
 
         return [self._new_page(p) for p in paths]
@@ -108,8 +121,12 @@ class Category(object):
     def _new_page(self, path):
         return Page(path, self.url_path, self)
 
+    @cached_property
+    def _categories_by_slug(self):
+        return dict((c.slug, c) for c in self.categories)
+
     def __getattr__(self, name):
-        for category in self.categories:
-            if category.slug == name:
-                return category
-        raise AttributeError
+        try:
+            return self._categories_by_slug[name]
+        except KeyError:
+            raise AttributeError(name)
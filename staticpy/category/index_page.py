@@ -5,6 +5,8 @@ from ..utils import cached_property
 
 
 class IndexPage(Page):
+    __slots__ = ('pages', 'page_number')
+
     def __init__(self, page_number, pages, *args, **kwargs):
         self.pages = pages
         self.page_number = page_number
@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+
+import os
+import json
+import hashlib
+
+from .utils import file_hash, gzip_chunks, read_chunks, write_to_file
+
+# Compressed copies live in a mirror of the output directory, so nothing is
+# written next to the site's own static files (output/static is a link to
+# them).
+DIRECTORY = '.gzip'
+
+EXTENSIONS = (
+    '.html', '.css', '.js', '.json', '.xml', '.svg', '.txt', '.ico',
+)
+
+
+def compressed_path(output_path, path):
+    '''The path of the compressed copy of the output file path'''
+    relative = os.path.relpath(path, output_path)
+    return os.path.join(output_path, DIRECTORY, relative + '.gz')
+
+
+def compressed_copy(output_path, path):
+    '''Find an up to date compressed copy of the output file path
+
+    returns: the copy's path, or None if there is none
+    '''
+    copy = compressed_path(output_path, path)
+    try:
+        if os.path.getmtime(copy) >= os.path.getmtime(path):
+            return copy
+    except OSError:
+        pass
+    return None
+
+
+def _make_directories(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def _output_files(output_path):
+    '''Yield every file in the output directory, skipping dot files and
+    directories (the manifest, the compressed copies...)
+    '''
+    for path, directories, files in os.walk(output_path, followlinks=True):
+        directories[:] = [d for d in directories if not d.startswith('.')]
+        for name in files:
+            if not name.startswith('.'):
+                yield os.path.join(path, name)
+
+
+class Compressor(object):
+    '''Write gzipped copies of the compressible files in an output directory
+
+    Files with a compressible extension and at least min_size bytes get a
+    copy at .gzip/<path>.gz, which the dev server and the S3 uploader send
+    in place of the file.  The hash of every file compressed is kept in
+    .gzip/.index.json, a file whose contents have not changed since it was
+    last compressed is skipped.  Copies of files that are gone are removed.
+
+    params:
+        output_path: the directory the site is built into
+        min_size: files smaller than this are not worth compressing
+    '''
+    file_name = '.index.json'
+
+    def __init__(self, output_path, min_size=1024):
+        self.output_path = output_path
+        self.min_size = min_size
+        self.path = os.path.join(output_path, DIRECTORY, self.file_name)
+
+    def compress(self):
+        '''returns: the number of files compressed'''
+        old = self.load()
+        index = {}
+        compressed = 0
+        for path in _output_files(self.output_path):
+            stat = os.stat(path)
+            if not self._compressible(path, stat.st_size):
+                continue
+
+            relative = os.path.relpath(path, self.output_path)
+            entry = old.pop(relative, None)
+            copy = compressed_path(self.output_path, path)
+            if self._outdated(path, stat, entry, copy):
+                entry = self._compress(path, stat, copy)
+                compressed += 1
+            index[relative] = entry
+
+        for relative in old:
+            copy = compressed_path(
+                self.output_path,
+                os.path.join(self.output_path, relative),
+            )
+            if os.path.isfile(copy):
+                os.remove(copy)
+
+        _make_directories(os.path.dirname(self.path))
+        write_to_file(self.path, json.dumps(index))
+        return compressed
+
+    def _compressible(self, path, size):
+        return size >= self.min_size and path.endswith(EXTENSIONS)
+
+    def _outdated(self, path, stat, entry, copy):
+        if not entry or not os.path.isfile(copy):
+            return True
+        if (entry['mtime'], entry['size']) == (stat.st_mtime, stat.st_size):
+            return False
+        if file_hash(path) != entry['hash']:
+            return True
+
+        # Rewritten with the same contents, the copy has to stay newer
+        os.utime(copy, None)
+        entry['mtime'] = stat.st_mtime
+        return False
+
+    def _compress(self, path, stat, copy):
+        md5 = hashlib.md5()
+
+        def chunks():
+            for chunk in read_chunks(path):
+                md5.update(chunk)
+                yield chunk
+
+        _make_directories(os.path.dirname(copy))
+        if not write_to_file(copy, gzip_chunks(chunks())):
+            os.utime(copy, None)
+        return {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': md5.hexdigest(),
+        }
+
+    def load(self):
+        '''returns: the index of the files compressed by the last build'''
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
@@ -2,6 +2,8 @@ from __future__ import absolute_import
 
 import os
 import re
+import json
+import threading
 
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
@@ -10,68 +12,137 @@ from .utils import logger
 
 IGNORE = (
     r'\.swp$',
-    r'sitemap\.xml$',
+    r'sitemap(-\d+)?\.xml(\.gz)?$',
+    # write_to_file's temporary files, the sitemap is written through
+    # output/static, a link to the static directory we watch
+    r'(^|[\\/])\.[^\\/]+\.[A-Za-z0-9_]{6}$',
 )
 
-IGNORE = (re.compile(x) for x in IGNORE)
+IGNORE = [re.compile(x) for x in IGNORE]
+
+# Seconds without a file event before a batch of changes is handled
+QUIET_PERIOD = 0.2
 
 
 class FileUpdated(FileSystemEventHandler):
-    _last_update = 0
     '''Define callbacks for watchdog
 
-    The callback are:
-        static changes: copy new/modified file into output_path/static/..
-        dynamic changes: recompile site
-
-        All changes: If self.clients_queue has entris we loop through each
-            client to notify them of the changes, this allows the browser
-            to refresh without user intervention.
+    Events are collected into a batch until no event has arrived for
+    quiet_period seconds, so a save-all or a git checkout is handled once,
+    then:
+        static changes: nothing to build, output_path/static links to them
+        dynamic changes: recompile the site, once, scoped to the changed
+            files
+
+        All changes: If we have a socket_server we tell the connected
+            browsers about the change, this allows the browser to refresh
+            without user intervention.  Only the browsers showing a page
+            that was re-rendered reload, stylesheet changes are swapped in
+            without a reload.
     '''
-    def __init__(self, clients_queue, site):
-        self.clients_queue = clients_queue
+    def __init__(self, socket_server, site, web_server=None,
+                 quiet_period=QUIET_PERIOD):
+        self.socket_server = socket_server
         self.site = site
+        self.web_server = web_server
+        self.quiet_period = quiet_period
         self.static_dir = os.path.join(site.input_path, 'static')
+        self._pending = set()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
         FileSystemEventHandler.__init__(self)
 
-    def _check_event(self, event):
-        if event.is_directory:
-            return True
+    def _ignored(self, path):
+        return any(x.search(path) for x in IGNORE)
 
-        for i in IGNORE:
-            if i.search(event.src_path):
-                return True
-        try:
-            mod_time = os.path.getctime(event.src_path)
-        except OSError:
-            return False
+    def dispatch(self, event):
+        if event.is_directory:
+            return
 
-        if mod_time - self._last_update < .1:
-            self._last_update = mod_time
-            return True
+        paths = [event.src_path, getattr(event, 'dest_path', None)]
+        paths = [x for x in paths if x and not self._ignored(x)]
+        if not paths:
+            return
 
-    def dispatch(self, event):
-        if not self._check_event(event):
+        with self._lock:
+            self._pending.update(paths)
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.quiet_period, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        '''Handle the changes collected so far'''
+        with self._lock:
+            paths, self._pending = self._pending, set()
+        if not paths:
             return
 
-        if not event.src_path.startswith(self.static_dir):
+        # A batch that arrives mid-build waits for it, builds never overlap
+        with self._build_lock:
+            self._handle(paths)
+
+    def stop(self):
+        '''Drop any changes waiting for the quiet period to end'''
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._pending = set()
+
+    def _handle(self, paths):
+        static = self.static_dir + os.sep
+        assets = sorted(x for x in paths if x.startswith(static))
+        dynamic = sorted(x for x in paths if not x.startswith(static))
+
+        pages = []
+        if dynamic:
             try:
-                logger.info('Recompiling Site')
-                self.site.recompile()
+                logger.info(
+                    'Recompiling Site: {count} files changed',
+                    count=len(dynamic),
+                )
+                pages = self.site.recompile(dynamic)
+                if self.web_server:
+                    self.web_server.update(self.site)
                 logger.success('Done Recompiling')
             except Exception as e:
                 logger.warning('Error Recompiling {error}', error=e)
+                pages = None
+
+        if self.socket_server:
+            self.notify(pages, assets)
 
-        if self.clients_queue:
-            self.notify()
+    def notify(self, pages=None, assets=()):
+        '''Tell the browsers what changed
 
-    def notify(self):
-        while not self.clients_queue.empty():
-            client = self.clients_queue.get()
-            client.send('update')
+        params:
+            pages: the pages re-rendered, None if the whole site may have
+                changed
+            assets: the static files that changed
+        '''
+        if not all(x.endswith('.css') for x in assets):
+            self.socket_server.broadcast(json.dumps({'reload': True}))
+            return
+        if assets:
+            urls = [self._asset_url(x) for x in assets]
+            self.socket_server.broadcast(json.dumps({'css': urls}))
+        if pages is None:
+            self.socket_server.broadcast(json.dumps({'reload': True}))
+        elif pages:
+            self.socket_server.broadcast(
+                json.dumps({'reload': True}),
+                urls=[p.url for p in pages],
+            )
 
+    def _asset_url(self, path):
+        relative = os.path.relpath(path, self.static_dir)
+        return '/static/' + relative.replace(os.sep, '/')
 
-def monitor_site(site, clients=None, wait=True):
+
+def monitor_site(site, socket_server=None, wait=True, web_server=None,
+                 quiet_period=QUIET_PERIOD):
     '''Monitor site_path for changes
 
     We start a watchdog observer to monitor the site_path.  Once we are
@@ -80,17 +151,17 @@ def monitor_site(site, clients=None, wait=True):
 
     params:
         site: a Site object
-        clients: a Queue.Queue() containing WebSocket clients
+        socket_server: a SocketServer to tell the browsers about changes
+        web_server: a WebServer to update with the pages after each
+            recompile
+        quiet_period: seconds to wait for more changes before recompiling
     '''
+    handler = FileUpdated(socket_server, site, web_server, quiet_period)
     observer = Observer()
     for directory in ['dynamic', 'static']:
         path = os.path.join(site.input_path, directory)
         if os.path.isdir(path):
-            observer.schedule(
-                FileUpdated(clients, site),
-                path=path,
-                recursive=True
-            )
+            observer.schedule(handler, path=path, recursive=True)
 
     observer.start()
     if wait:
@@ -99,3 +170,4 @@ def monitor_site(site, clients=None, wait=True):
         logger.warning('Shutting Down')
         observer.stop()
         observer.join()
+        handler.stop()
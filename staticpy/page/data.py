@@ -1,16 +1,59 @@
 from __future__ import absolute_import
 
 
+_NOT_LOADED = object()
+
+
+def attribute_name(name):
+    '''The attribute a page file header sets, dashes become underscores'''
+    return name.strip().replace('-', '_')
+
+
+class LazyValue(object):
+    '''A value that is read from disk the first time it is used
+
+    The value is kept once it is loaded.  A page's Data is dropped by
+    page.bust_cache(), and its LazyValues with it, so a page that is read
+    again after its file changes loads the new value.
+
+    params:
+        load: a function returning the value
+    '''
+    __slots__ = ('load', 'value')
+
+    def __init__(self, load):
+        self.load = load
+        self.value = _NOT_LOADED
+
+    def get(self):
+        if self.value is _NOT_LOADED:
+            self.value = self.load()
+        return self.value
+
+
 class Data(object):
+    __slots__ = ('_data',)
+
     def __init__(self, **kwargs):
         self._data = kwargs
 
     def set(self, name, value):
-        name = name.strip().replace('-', '_')
+        # Every page shares the same few attribute names, interning them
+        # keeps one copy of each name instead of one per page.
+        name = intern(str(attribute_name(name)))
         self._data[name] = value
 
     def get(self, key, default=None):
-        return self._data.get(key, default)
+        value = self._data.get(key, default)
+        if isinstance(value, LazyValue):
+            return value.get()
+        return value
 
     def __getattr__(self, name):
-        return self._data.get(name, '')
+        # Missing page attributes are blank in templates, but private and
+        # special names are not page attributes: hasattr(page, '__html__')
+        # or a library probing for its own markers has to see them missing.
+        # A header can still set an attribute starting with '_' though.
+        if name.startswith('_') and name not in self._data:
+            raise AttributeError(name)
+        return self.get(name, '')
@@ -8,7 +8,17 @@ from .writer import Writer
 
 
 class Page(object):
-    _cache = None
+    # Sites can have a lot of pages, slots keep each one small.
+    __slots__ = (
+        'site',
+        'category',
+        'file_path',
+        'url_path',
+        '_cache',
+    )
+
+    reader = Reader()
+    writer = Writer()
 
     def __init__(
         self,
@@ -16,12 +26,11 @@ class Page(object):
         url_path,
         category,
     ):
+        self._cache = None
         self.site = category.site
         self.category = category
         self.file_path = file_path
         self.url_path = url_path
-        self.writer = Writer(self)
-        self.reader = Reader(file_path)
 
     @cached_property
     def slug(self):
@@ -60,19 +69,19 @@ class Page(object):
 
     @cached_property
     def prev(self):
-        prev_page = None
-        for p in self.category.children:
-            if p == self:
-                return prev_page
-            prev_page = p
+        return self.category.neighbour(self, -1)
 
     @cached_property
     def next(self):
-        found = False
-        for p in self.category.children:
-            if found:
-                return p
-            found = p == self
+        return self.category.neighbour(self, 1)
+
+    @cached_property
+    def last_modified(self):
+        return self.reader.modified_at(self.file_path)
+
+    @property
+    def output_path(self):
+        return self.writer.path(self)
 
     @property
     def order(self):
@@ -81,9 +90,16 @@ class Page(object):
             return int(order)
         return float('inf')
 
+    def bust_cache(self):
+        self._cache = None
+
     def write(self):
+        '''Render the page to the output directory
+
+        returns: whether the file changed, or None for link only pages
+        '''
         if not self.no_render:
-            self.writer.write()
+            return self.writer.write(self)
 
     def __getattr__(self, name):
         return getattr(self._data, name)
@@ -93,7 +109,9 @@ class Page(object):
 
     @cached_property
     def _data(self):
-        return self.reader.read()
+        profiler = self.site.profiler
+        with profiler.phase('parse'):
+            return self.reader.read(self.file_path, profiler)
 
     @cached_property
     def _url(self):
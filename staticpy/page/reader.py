@@ -3,19 +3,22 @@ from __future__ import absolute_import
 import re
 import os
 from datetime import datetime
+from functools import partial
 
-from .data import Data
+from .data import Data, LazyValue, attribute_name
 
 NAME_REGEX = re.compile(
     r'^:(?P<attribute>[a-z\-_]+)'
     r'(?:\[(?P<type>[a-z]+)\])?:'
-    r'\s*(?P<value>.*)$'
+    r'[^\S\n]*(?P<value>.*)$',
+    re.MULTILINE,
 )
 
 
-def _read_file(path):
-    with open(path) as fp:
-        return fp.readlines()
+def _read_range(path, start, end):
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        return fp.read(end - start)
 
 
 def _to_list(value):
@@ -34,40 +37,142 @@ def _cast(value, data_type):
     return value
 
 
+def _version(stat):
+    return stat.st_mtime, stat.st_size
+
+
+def _load(path, version, name, value, data_type, start, end):
+    '''Read a large value back from its offsets in the file
+
+    If the file has changed since it was read the offsets may be wrong, so
+    the file is read again and the value taken from that.
+    '''
+    if _version(os.stat(path)) != version:
+        return Reader().read(path).get(attribute_name(name))
+    return _cast(value + _read_range(path, start, end), data_type)
+
+
+def _profiled(profiler, load):
+    with profiler.phase('parse'):
+        return load()
+
+
+def _attributes(fp, lazy_size, chunk_size=65536):
+    '''Find every attribute in a page file in one pass over its bytes
+
+    An attribute's value is the rest of its header line followed by every
+    line up to the next header, text before the first header belongs to an
+    attribute with no name.  Headers have to start with a ':' at the
+    beginning of a line, so the file is read chunk_size bytes at a time and
+    scanned with str.find(':'), only a ':' that follows a '\\n' is tried
+    against the regex (Python 2's str.find is several times faster looking
+    for one byte than for two).  A value's text is only kept while it is at
+    most lazy_size bytes, the rest of a large value is left on disk and
+    found again by its offsets, so memory use stays flat however large the
+    file.
+
+    yields: (name, data_type, first line value, body start, body end,
+        body text or None if the body is larger than lazy_size)
+    '''
+    name, data_type, value, start = '', None, '', 0
+    # buf holds the file from offset base, the '\n' in front stands in for
+    # the line before the file so a header on the first line is found too.
+    # file.read(n) only returns less than n bytes at the end of the file.
+    buf, base, scan, eof = '\n', -1, 0, False
+    while True:
+        colon = buf.find(':', scan + 1)
+        while colon >= 0 and buf[colon - 1] != '\n':
+            colon = buf.find(':', colon + 1)
+
+        if colon >= 0:
+            # A header is only known to be complete once its line ends
+            match = NAME_REGEX.match(buf, colon)
+            if match and (eof or match.end() < len(buf)):
+                end = base + colon
+                text = None
+                if end - start <= lazy_size:
+                    text = buf[start - base:colon]
+                yield name, data_type, value, start, end, text
+                name, data_type, value = match.groups()
+                scan = match.end()
+                start = base + scan + 1
+                continue
+            if not match and (eof or buf.find('\n', colon) >= 0):
+                scan = colon
+                continue
+        elif eof:
+            break
+
+        # Read on, dropping what is no longer needed: text that is not
+        # kept, but never a header line still being read or the last byte,
+        # which could be the '\n' in front of the next header.
+        searched = colon if colon >= 0 else len(buf)
+        drop = searched - 1
+        if base + searched - start <= lazy_size:
+            drop = min(drop, start - base)
+        base += drop
+        scan = searched - 1 - drop
+        chunk = fp.read(chunk_size)
+        eof = len(chunk) < chunk_size
+        buf = buf[drop:] + chunk
+
+    # A header on the last line, with no '\n' after it, has no body
+    end = base + len(buf)
+    start = min(start, end)
+    text = buf[start - base:] if end - start <= lazy_size else None
+    yield name, data_type, value, start, end, text
+
+
 class Reader(object):
-    def __init__(self, path):
-        self.path = path
+    '''Read the attributes out of .page files
 
-    def read(self):
-        output = Data()
+    Small attributes (titles, order, published...) are read straight into
+    the page's Data.  Values longer than lazy_size, usually the body, are
+    only read from the file when something uses them, so building the page
+    tree and sorting pages never holds every body in memory.
 
-        attribute, value, data_type = '', '', None
-        for line in _read_file(self.path):
-            data = NAME_REGEX.match(line)
-            if data:
-                if value:
-                    output.set(
-                        attribute,
-                        _cast(value, data_type),
-                    )
+    A Reader keeps no per file state, every page shares one.
+    '''
+    lazy_size = 1024
 
-                attribute = data.group('attribute')
-                value = data.group('value')
-                data_type = data.group('type')
-            else:
-                value += line
-        output.set(
-            attribute,
-            _cast(value, data_type),
-        )
+    def read(self, path, profiler=None):
+        '''Read the attributes of the page file at path
+
+        params:
+            path: the page file
+            profiler: if given, large values are loaded in its 'parse'
+                phase
+        '''
+        output = Data()
+        version = None
+
+        with open(path, 'rb') as fp:
+            attributes = list(_attributes(fp, self.lazy_size))
+            last = attributes[-1]
+            for attribute in attributes:
+                name, data_type, value, start, end, text = attribute
+                if not value and start == end and attribute is not last:
+                    continue
+
+                if text is None:
+                    # Only large values are read again, and need to know
+                    # if the file changed
+                    if version is None:
+                        version = _version(os.fstat(fp.fileno()))
+                    load = partial(
+                        _load, path, version,
+                        name, value, data_type, start, end,
+                    )
+                    if profiler is not None:
+                        load = partial(_profiled, profiler, load)
+                    value = LazyValue(load)
+                else:
+                    value = _cast(value + text, data_type)
+                output.set(name, value)
         return output
 
-    @property
-    def _created_at(self):
-        created_at = os.path.getctime(self.path)
-        return datetime.fromtimestamp(created_at)
+    def created_at(self, path):
+        return datetime.fromtimestamp(os.path.getctime(path))
 
-    @property
-    def _modified_at(self):
-        modified_at = os.path.getmtime(self.path)
-        return datetime.fromtimestamp(modified_at)
+    def modified_at(self, path):
+        return datetime.fromtimestamp(os.path.getmtime(path))
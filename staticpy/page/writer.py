@@ -2,44 +2,39 @@ from __future__ import absolute_import
 
 import os
 
-from jinja2 import Environment, PackageLoader
-
-from ..utils import write_to_file
+from ..utils import buffered, write_to_file
 
 
 class Writer(object):
+    '''Render pages into the output directory
 
-    def __init__(self, page):
-        self.category = page.category
-        self.site = page.site
-        self.page = page
+    A Writer keeps no per page state, every page shares one.
+    '''
 
-    def write(self):
-        write_to_file(self.path, self._render())
+    def write(self, page):
+        with page.site.profiler.phase('write'), page.site.rendering(page):
+            return write_to_file(self.path(page), self._render(page))
 
-    @property
-    def path(self):
+    def path(self, page):
         return '{path}.html'.format(
             path=os.path.join(
-                self.site.output_path,
-                self.category.url_path,
-                self.page.slug
+                page.site.output_path,
+                page.category.url_path,
+                page.slug
             ),
         )
 
-    @property
-    def template(self):
-        env = Environment(
-            loader=PackageLoader('dynamic', 'templates')
-        )
-        return env.get_template(
-            self.page.template_name
-        )
-
-    def _render(self):
-        return self.template.render(
-            page=self.page,
-            category=self.category,
-            navigation_links=self.site.navigation_links,
-            client_js_code=self.site.client_js_code,
+    def template(self, page):
+        with page.site.profiler.phase('templates'):
+            return page.site.template_env.get_template(page.template_name)
+
+    def _render(self, page):
+        '''Render the page as a stream of encoded chunks'''
+        template = self.template(page)
+        chunks = template.generate(
+            page=page,
+            category=page.category,
+            navigation_links=page.site.navigation_links,
+            client_js_code=page.site.client_js_code,
         )
+        return page.site.profiler.render(template.name, buffered(chunks))
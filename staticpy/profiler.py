@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import time
+import cProfile
+import resource
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from .utils import logger
+
+
+class Profiler(object):
+    '''Time the phases of a build
+
+    Phases nest, a phase's time excludes the phases run inside it, so the
+    page parsing done while rendering (page files read for the first time
+    and large values loaded from disk) is counted as parsing and not as
+    rendering.  Template renders are also timed per template.
+
+    Builds with --jobs add each worker's profiler to the parent's, their
+    times are the sum over the workers rather than wall clock time.
+    '''
+    def __init__(self):
+        self.phases = defaultdict(float)
+        self.templates = defaultdict(float)
+        self.renders = Counter()
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        frame = [time.time(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.time() - frame[0]
+            self.phases[name] += elapsed - frame[1]
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+    def render(self, name, chunks):
+        '''Yield chunks, timing the work producing each one as part of a
+        render of the template name.
+        '''
+        self.renders[name] += 1
+        chunks = iter(chunks)
+        while True:
+            start = time.time()
+            with self.phase('render'):
+                chunk = next(chunks, None)
+            self.templates[name] += time.time() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    def merge(self, other):
+        for name, seconds in other.phases.items():
+            self.phases[name] += seconds
+        for name, seconds in other.templates.items():
+            self.templates[name] += seconds
+        self.renders.update(other.renders)
+
+    def report(self):
+        for name, seconds in sorted(self.phases.items(), key=_by_time):
+            logger.info('{name:>10}: {time:.3f}s', name=name, time=seconds)
+        for name, seconds in sorted(self.templates.items(), key=_by_time):
+            logger.info(
+                '{name:>20}: {count} renders, {time:.3f}s',
+                name=name,
+                count=self.renders[name],
+                time=seconds,
+            )
+        logger.info(
+            'Peak memory: {memory:.1f}MB',
+            memory=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+        )
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class NullProfiler(object):
+    '''Stands in for a Profiler when the build is not profiled, so timing
+    the build costs nothing unless it was asked for.
+    '''
+    _phase = _NoPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def render(self, name, chunks):
+        return chunks
+
+    def merge(self, other):
+        pass
+
+    def report(self):
+        pass
+
+
+def _by_time(item):
+    return -item[1]
+
+
+@contextmanager
+def profile_to_file(path):
+    '''Run the enclosed code under cProfile, and tracemalloc if available
+
+    The cProfile stats are dumped to path (read them with pstats) and the
+    tracemalloc snapshot to path.tracemalloc.
+    '''
+    profile = cProfile.Profile()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        logger.info('Profile written to {path}', path=path)
+        if tracemalloc is not None:
+            tracemalloc.take_snapshot().dump(path + '.tracemalloc')
+            tracemalloc.stop()
+            logger.info('Memory snapshot written to {path}.tracemalloc',
+                        path=path)
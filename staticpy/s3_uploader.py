@@ -1,13 +1,31 @@
 from __future__ import absolute_import
 
 import os
-from multiprocessing import Pool
+import json
+import time
+import Queue
+import base64
+import hashlib
+import binascii
+import mimetypes
+import threading
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 from boto.s3.connection import S3Connection, OrdinaryCallingFormat
-from boto.s3.bucket import Bucket
 from boto.s3.key import Key
 
-from .utils import logger, walk_directory
+from .compression import compressed_copy
+from .utils import file_hash, logger, walk_directory, write_to_file
+
+# The most keys S3 deletes in one request
+DELETE_BATCH_SIZE = 1000
+
+# Files over MULTIPART_THRESHOLD bytes are uploaded in PART_SIZE parts, S3
+# needs parts of at least 5MB and allows at most 10,000 of them
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
 
 
 def transform(path):
@@ -25,11 +43,490 @@ def get_key(base, path):
 
 
 def file_filter(path):
-    file_name = os.path.basename(path)
-    return not file_name.startswith('.')
+    '''Skip dot files and anything in a dot directory (the build
+    manifest, compressed copies...), path is relative to the upload root
+    '''
+    return not any(x.startswith('.') for x in path.split(os.sep))
+
+
+def content_type(path):
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed or Key.DefaultContentType
+
+
+def compressed_headers(path):
+    return {
+        'Content-Type': content_type(path),
+        'Content-Encoding': 'gzip',
+    }
+
+
+def part_size(size):
+    '''The size of the parts a file of size bytes is uploaded in'''
+    return max(PART_SIZE, -(-size // MAX_PARTS))
+
+
+def part_digests(path, size, chunk_size=65536):
+    '''The md5 hex digest of each part_size(size) piece of a file
+
+    The file is read chunk_size bytes at a time, however big the parts.
+    '''
+    digests = []
+    with open(path, 'rb') as fp:
+        for _ in xrange(0, size, part_size(size)):
+            md5 = hashlib.md5()
+            remaining = part_size(size)
+            while remaining:
+                chunk = fp.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                remaining -= len(chunk)
+            digests.append(md5.hexdigest())
+    return digests
+
+
+def multipart_etag(digests):
+    '''The ETag S3 gives a multipart upload: the md5 of its parts' md5s
+    followed by the number of parts.
+    '''
+    md5 = hashlib.md5(b''.join(binascii.unhexlify(d) for d in digests))
+    return '%s-%s' % (md5.hexdigest(), len(digests))
+
+
+def connect(aws_keys):
+    return S3Connection(*aws_keys, calling_format=OrdinaryCallingFormat())
 
 
-def upload_to_s3(aws_keys, bucket, source_path):
+def _md5(hexdigest):
+    '''The (hex, base64) md5 pair boto takes to skip hashing a file again'''
+    return hexdigest, base64.b64encode(binascii.unhexlify(hexdigest))
+
+
+def _is_page(local_file):
+    _, path, _ = local_file
+    return content_type(path) == 'text/html'
+
+
+def _summary(sent, unchanged, failed, seconds):
+    size = sum(s for _, s in sent) / (1024. * 1024)
+    seconds = max(seconds, 0.001)
+    logger.success(
+        'Uploaded {count} files, {size:.1f}MB in {seconds:.1f}s '
+        '({rate:.2f}MB/s, {files:.1f} files/s), {unchanged} unchanged',
+        count=len(sent),
+        size=size,
+        seconds=seconds,
+        rate=size / seconds,
+        files=len(sent) / seconds,
+        unchanged=unchanged,
+    )
+    if failed:
+        logger.error('{failed} files failed to upload', failed=failed)
+
+
+def _on_bucket(upload, bucket):
+    '''The multipart upload, through another connection's bucket
+
+    boto connections are not thread safe, so each thread sending parts has
+    to reach the upload through its own connection.
+    '''
+    copy = type(upload)(bucket)
+    copy.key_name = upload.key_name
+    copy.id = upload.id
+    return copy
+
+
+def _retry(call, retries, backoff):
+    '''Call call(), retrying up to retries times if it raises
+
+    Each retry waits backoff seconds longer than the last, doubling the
+    wait each time.  The error of the last attempt is raised.
+    '''
+    for attempt in xrange(retries):
+        try:
+            return call()
+        except Exception:
+            time.sleep(backoff * 2 ** attempt)
+    return call()
+
+
+def _batches(items, size):
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+class Scheduler(object):
+    '''Run a function over a stream of items in a pool of threads
+
+    Items are handed to the threads through a queue holding at most
+    queue_size of them, so items can be produced as the threads work.  A
+    call that raises is retried up to retries times, after waiting backoff
+    seconds, doubling the wait each time.  Items that still fail are kept
+    in failures with their last error rather than stopping the rest.
+
+    params:
+        work: the function to call with each item
+        threads: the number of threads to run
+        queue_size: the most items waiting for a thread, defaults to four
+            per thread
+        retries: the number of times to retry a failed item
+        backoff: the seconds to wait before the first retry
+    '''
+    def __init__(self, work, threads=10, queue_size=None, retries=3,
+                 backoff=1.0):
+        self.work = work
+        self.threads = threads
+        self.queue_size = queue_size or threads * 4
+        self.retries = retries
+        self.backoff = backoff
+        self.results = []
+        self.failures = []
+        self._queue = Queue.Queue(self.queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        '''Work through items, blocking until every one is done
+
+        The threads are started by the first run and kept for later ones,
+        until close().
+
+        returns: self, with the (item, result) of every item that
+            succeeded in results and the (item, error) of the rest in
+            failures
+        '''
+        if not self._workers:
+            for _ in xrange(self.threads):
+                worker = threading.Thread(target=self._worker)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+        for item in items:
+            self._queue.put((item,))
+        self._queue.join()
+        return self
+
+    def close(self):
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._attempt(job[0])
+            finally:
+                self._queue.task_done()
+
+    def _attempt(self, item):
+        try:
+            result = _retry(
+                partial(self.work, item),
+                self.retries,
+                self.backoff,
+            )
+        except Exception as error:
+            with self._lock:
+                self.failures.append((item, error))
+        else:
+            with self._lock:
+                self.results.append((item, result))
+
+
+class UploadManifest(object):
+    '''A record of the files earlier deploys uploaded to a bucket
+
+    For every file uploaded it keeps the size and mtime the file had, its
+    md5 (for multipart uploads the ETag the parts should add up to) and
+    the ETag S3 gave it.  A file whose stat has not changed since,
+    and whose key still has that ETag, can be skipped without reading it.
+
+    The manifest is saved every save_every uploads as well as at the end,
+    so a deploy that is interrupted picks up where it stopped.  It is
+    stored as a dot file in the directory uploaded, one per bucket.
+
+    params:
+        source_path: the directory uploaded
+        bucket_name: the bucket it is uploaded to
+    '''
+    save_every = 100
+
+    def __init__(self, source_path, bucket_name):
+        self.path = os.path.join(source_path, '.upload-%s.json' % bucket_name)
+        self.files = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                self.files = json.load(fp)
+        except (IOError, ValueError):
+            pass
+        return self
+
+    def save(self):
+        with self._lock:
+            self._unsaved = 0
+            contents = json.dumps(self.files)
+        write_to_file(self.path, contents)
+
+    def get(self, path, stat):
+        '''returns: the entry for path if its stat has not changed'''
+        entry = self.files.get(path)
+        if not entry:
+            return None
+        if (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+            return None
+        return entry
+
+    def record(self, path, stat, md5, etag):
+        with self._lock:
+            self.files[path] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'md5': md5,
+                'etag': etag,
+            }
+            self._unsaved += 1
+            unsaved = self._unsaved
+        if unsaved >= self.save_every:
+            self.save()
+
+    def retain(self, paths):
+        '''Forget every file not in paths'''
+        paths = set(paths)
+        with self._lock:
+            for path in list(self.files):
+                if path not in paths:
+                    del self.files[path]
+
+
+class Uploader(object):
+    '''Sync a directory to an S3 bucket
+
+    The bucket is listed once to find the ETag of every key, a file is only
+    uploaded if its md5 differs from its key's ETag.  Files the
+    UploadManifest shows are unchanged since they were uploaded are not
+    even hashed.  Keys with no local file are deleted, DELETE_BATCH_SIZE at
+    a time.
+
+    Uploads are run by a Scheduler, each of its threads opening one
+    connection on its first upload and reusing it for the rest.  Failed
+    uploads are retried, and the deploy ends with a summary of what was
+    sent and how fast.  Files over multipart_threshold bytes are sent as a
+    multipart upload, with part_threads parts in flight at a time.
+
+    Static files are uploaded before any html page, so while a deploy is
+    running pages never link to assets that are not there yet.  If any
+    static file fails no pages are uploaded and nothing is deleted.
+
+    params:
+        connect: a callable returning a boto S3Connection, or anything with
+            the same get_bucket (such as a stand-in for tests)
+        bucket_name: the bucket to upload to
+        source_path: the directory to upload
+        threads: the number of concurrent uploads
+        multipart_threshold: the smallest file sent as a multipart upload
+        part_threads: the number of concurrent part uploads per file
+        retries: the number of times to retry a failed upload
+        backoff: the seconds to wait before the first retry
+    '''
+    def __init__(self, connect, bucket_name, source_path, threads=10,
+                 multipart_threshold=MULTIPART_THRESHOLD, part_threads=4,
+                 retries=3, backoff=1.0):
+        self.connect = connect
+        self.bucket_name = bucket_name
+        self.source_path = source_path
+        self.threads = threads
+        self.multipart_threshold = multipart_threshold
+        self.part_threads = part_threads
+        self.retries = retries
+        self.backoff = backoff
+        self.failures = []
+        self.manifest = UploadManifest(source_path, bucket_name).load()
+        self._local = threading.local()
+
+    @property
+    def bucket(self):
+        '''The bucket, on this thread's connection'''
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is None:
+            bucket = self._local.bucket = self.connect().get_bucket(
+                self.bucket_name,
+                validate=False,
+            )
+        return bucket
+
+    def sync(self):
+        '''returns: the keys uploaded and the keys deleted'''
+        start = time.time()
+        etags = self.remote_etags()
+        files = self.local_files()
+        assets = [f for f in files if not _is_page(f)]
+        pages = [f for f in files if _is_page(f)]
+
+        scheduler = Scheduler(
+            partial(self._sync_file, etags),
+            self.threads,
+            retries=self.retries,
+            backoff=self.backoff,
+        )
+        try:
+            scheduler.run(assets)
+            if scheduler.failures:
+                logger.error(
+                    'Not uploading pages, {count} static files failed',
+                    count=len(scheduler.failures),
+                )
+            else:
+                scheduler.run(pages)
+        finally:
+            scheduler.close()
+            self.manifest.save()
+
+        self.failures = scheduler.failures
+        for (key, _, _), error in self.failures:
+            logger.error('Failed to upload `{key}`: {error}', key=key,
+                         error=error)
+        sent = [(f, size) for f, size in scheduler.results if size is not None]
+        _summary(
+            sent,
+            len(scheduler.results) - len(sent),
+            len(self.failures),
+            time.time() - start,
+        )
+
+        self.manifest.retain(path for _, path, _ in files)
+        self.manifest.save()
+        if self.failures:
+            return [f[0] for f, _ in sent], []
+
+        current = set(key for key, _, _ in files)
+        deleted = sorted(set(etags) - current)
+        self.delete(deleted)
+        return [f[0] for f, _ in sent], deleted
+
+    def remote_etags(self):
+        '''returns: a dict of every key in the bucket to its ETag'''
+        return dict(
+            (key.name, key.etag.strip('"'))
+            for key in self.bucket.list()
+        )
+
+    def local_files(self):
+        '''Find the files to upload
+
+        Files with an up to date precompressed copy are uploaded gzipped,
+        with a Content-Encoding header.
+
+        returns: a list of (key, path to upload, headers)
+        '''
+        files = []
+        for path in walk_directory(self.source_path):
+            if not file_filter(os.path.relpath(path, self.source_path)):
+                continue
+            key = get_key(self.source_path, path)
+            copy = compressed_copy(self.source_path, path)
+            if copy is None:
+                files.append((key, path, None))
+            else:
+                files.append((key, copy, compressed_headers(path)))
+        return files
+
+    def delete(self, keys):
+        logger.warning('Deleting {count} files from s3', count=len(keys))
+        for batch in _batches(keys, DELETE_BATCH_SIZE):
+            for key in batch:
+                logger.warning('Deleting `{key}` from S3', key=key)
+            self.bucket.delete_keys(batch)
+
+    def _sync_file(self, etags, local_file):
+        '''returns: the bytes uploaded, or None if the file is unchanged'''
+        key, path, headers = local_file
+        stat = os.stat(path)
+        etag = etags.get(key)
+        entry = self.manifest.get(path, stat)
+        if entry and entry['etag'] == etag:
+            return None
+
+        size = stat.st_size
+        multipart = size >= self.multipart_threshold
+        digests = None
+        if entry:
+            md5 = entry['md5']
+        elif multipart:
+            digests = part_digests(path, size)
+            md5 = multipart_etag(digests)
+        else:
+            md5 = file_hash(path)
+
+        changed = md5 != etag
+        if changed:
+            if multipart:
+                digests = digests or part_digests(path, size)
+                etag = self._upload_parts(key, path, size, headers, digests)
+            else:
+                etag = self._upload(key, path, headers, md5)
+            logger.success('Uploaded: {key}', key=key)
+
+        self.manifest.record(path, stat, md5, etag)
+        return size if changed else None
+
+    def _upload(self, key, path, headers, md5):
+        s3_key = self.bucket.new_key(key)
+        with open(path, 'rb') as fh:
+            s3_key.set_contents_from_file(fh, headers=headers, md5=_md5(md5))
+        return s3_key.etag.strip('"')
+
+    def _upload_parts(self, key, path, size, headers, digests):
+        '''Upload a file as a multipart upload, returning its ETag
+
+        The parts are sent in parallel, each from its own file handle,
+        boto streams them from the file so memory use stays flat.  Each
+        part thread sends through its own connection, see bucket.  A part
+        that fails is retried on its own, with the same backoff as whole
+        files, and only if it still fails is the upload cancelled so S3
+        does not keep the parts.
+        '''
+        headers = headers or {'Content-Type': content_type(path)}
+        upload = self.bucket.initiate_multipart_upload(key, headers=headers)
+        length = part_size(size)
+
+        def send_part(number):
+            offset = (number - 1) * length
+            with open(path, 'rb') as fp:
+                fp.seek(offset)
+                _on_bucket(upload, self.bucket).upload_part_from_file(
+                    fp,
+                    number,
+                    md5=_md5(digests[number - 1]),
+                    size=min(length, size - offset),
+                )
+
+        def send(number):
+            _retry(partial(send_part, number), self.retries, self.backoff)
+
+        pool = ThreadPool(self.part_threads)
+        try:
+            pool.map(send, xrange(1, len(digests) + 1), chunksize=1)
+        except Exception:
+            upload.cancel_upload()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        return upload.complete_upload().etag.strip('"')
+
+
+def upload_to_s3(aws_keys, bucket, source_path,
+                 multipart_threshold=MULTIPART_THRESHOLD, threads=10):
     '''Upload a directory to S3
 
     Walks a directory uploading everyfile to s3, they S3 key is equivalent to
@@ -38,53 +535,24 @@ def upload_to_s3(aws_keys, bucket, source_path):
     Note:
         1) Only upload files that differ from what is currently in S3
         2) Delete files from S3 that are not present locally
-        3) Use multiprocessing to run upto 10 concurrent uploads
+        3) Run upto threads concurrent uploads, retrying failures
+        4) Files with an up to date precompressed copy are uploaded
+           gzipped, with a Content-Encoding header
+        5) Files over multipart_threshold bytes are uploaded in parts
 
     :param tuple aws_keys: ('access_key', 'secret_key')
     :param str bucket: amazon s3 bucket name
     :param str source_path: Path to the directory to upload
+    :param int multipart_threshold: the smallest file uploaded in parts
+    :param int threads: the number of concurrent uploads
+    :returns: True if every file was uploaded
     '''
-    current_keys = set()
-    pool = Pool(processes=10)
-    files = [p for p in walk_directory(source_path) if file_filter(p)]
-    for path in files:
-        key = get_key(source_path, path)
-        current_keys.add(key)
-        pool.apply_async(upload, [aws_keys, bucket, key, path])
-    pool.apply_async(delete_removed_keys, [aws_keys, bucket, current_keys])
-    pool.close()
-    pool.join()
-
-
-def delete_removed_keys(aws_keys, bucket, current_keys):
-    conn = S3Connection(*aws_keys, calling_format=OrdinaryCallingFormat())
-    bucket = conn.get_bucket(bucket)
-    old_keys = set([x.name for x in bucket.list()])
-    to_delete = old_keys - current_keys
-    logger.warning('Deleting {count} files from s3', count=len(to_delete))
-    for key in to_delete:
-        logger.warning('Deleting `{key}` from S3', key=key)
-    bucket.delete_keys(to_delete)
-
-
-def upload(credentials, bucket, key, file_path):
-    bucket = Bucket(
-        connection=S3Connection(*credentials, calling_format=OrdinaryCallingFormat()),
-        name=bucket
+    uploader = Uploader(
+        partial(connect, aws_keys),
+        bucket,
+        source_path,
+        threads=threads,
+        multipart_threshold=multipart_threshold,
     )
-
-    s3_key = bucket.get_key(key)
-    if s3_key:
-        old_hash = s3_key.etag.strip('"')
-    else:
-        s3_key = Key(bucket)
-        s3_key.key = key
-        old_hash = None
-
-    with open(file_path) as fh:
-        new_hash, _ = s3_key.compute_md5(fh)
-        if new_hash == old_hash:
-            logger.info("File {key} unchanged", key=key)
-        else:
-            s3_key.set_contents_from_file(fh)
-            logger.success('Uploaded: {key}', key=key)
+    uploader.sync()
+    return not uploader.failures
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import os
+
+
+def _signature(page):
+    '''The parts of a page that other pages depend on
+
+    Changing any of these moves the page within its category, in or out
+    of the navigation links rendered on every page, or to another url.
+    '''
+    return (
+        page.published,
+        page.order,
+        bool(page.include_in_navigation),
+        page.url,
+    )
+
+
+def _unique(pages):
+    seen = set()
+    for page in pages:
+        if page is not None and page not in seen:
+            seen.add(page)
+            yield page
+
+
+class Dependencies(object):
+    '''Map source .page files to the rendered pages that depend on them
+
+    When a page's source changes we have to re-render:
+        - the page itself
+        - its neighbours, whose prev/next point to it
+        - the index page of its category that lists it
+        - the pages whose templates looked it up with page_at or url_for
+        - the sitemap (the site writer always rewrites it)
+
+    If the change touches anything other pages are built from (published,
+    order, navigation, url) or the file is not a known page (new and
+    deleted pages, index pages, templates) we cannot scope the rebuild and
+    the caller has to recompile the whole site.
+
+    params:
+        site: a Site that has been built, so its pages have been read
+        signatures: the page signatures of an earlier build to compare
+            changes against, by default they are taken from site
+        lookups: the page lookups recorded by an earlier build, by default
+            site.lookups
+    '''
+    def __init__(self, site, signatures=None, lookups=None):
+        self.site = site
+        self.lookups = site.lookups if lookups is None else lookups
+        self.pages = {}
+        self.signatures = {}
+        for page in site.pages:
+            if page.file_path.endswith('index.page'):
+                continue
+            self.pages[page.file_path] = page
+            self.signatures[page.file_path] = _signature(page)
+
+        if signatures is not None:
+            self.signatures = signatures
+
+    def affected(self, paths):
+        '''Find the pages to re-render after paths changed
+
+        Re-reads each changed page as a side effect.
+
+        params:
+            paths: an iterable of changed source file paths
+        returns:
+            a list of pages, or None if the whole site must be rebuilt
+        '''
+        pages = []
+        for path in paths:
+            page = self._refresh(path)
+            if page is None:
+                return None
+
+            pages.extend([page, page.prev, page.next])
+            pages.extend(
+                i for i in page.category.index_pages if page in i.pages
+            )
+            pages.extend(self._dependents(path))
+        return list(_unique(pages))
+
+    def _dependents(self, path):
+        '''The pages that looked up the page read from path'''
+        return [
+            self.site.pages_by_url.get(url)
+            for url, paths in sorted(self.lookups.items())
+            if path in paths
+        ]
+
+    def _refresh(self, path):
+        page = self.pages.get(path)
+        if page is None or not os.path.isfile(path):
+            return None
+
+        page.bust_cache()
+        if _signature(page) != self.signatures.get(path):
+            return None
+        if page.include_in_navigation:
+            return None
+        return page
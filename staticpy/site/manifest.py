@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+
+import os
+import json
+import hashlib
+
+from ..utils import file_hash, walk_directory, write_to_file
+from .dependencies import Dependencies
+
+# Bump this when a change to staticpy changes what gets rendered
+VERSION = 2
+
+
+def _stat(site, path):
+    stat = site.tree.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def fingerprint(site):
+    '''Hash everything every page is rendered from, other than its source
+
+    This covers the templates and the settings passed into them, if it
+    changes between builds the whole site has to be re-rendered.
+    '''
+    md5 = hashlib.md5()
+    md5.update(repr((
+        VERSION,
+        site.base_url,
+        site.client_js_code,
+        site.include_drafts,
+    )))
+
+    templates = os.path.join(site.input_path, 'dynamic', 'templates')
+    for path in sorted(walk_directory(templates)):
+        md5.update(path)
+        md5.update(file_hash(path))
+    return md5.hexdigest()
+
+
+def source_files(site):
+    return [p for p in site.tree.walk() if p.endswith('.page')]
+
+
+def output_files(site):
+    outputs = [p.output_path for p in site.pages if not p.no_render]
+    outputs.extend(site.sitemap.paths)
+    return outputs
+
+
+class Manifest(object):
+    '''A record of what the last build read and wrote
+
+    The manifest is stored as json in the output directory.  For every
+    source .page file it records its mtime, size and hash, and the page
+    metadata other pages depend on, along with a fingerprint of the
+    templates and settings, the pages each page looked up while it was
+    rendered and the list of files the build produced.
+
+    The next build of the same output directory uses it to re-render only
+    the pages affected by the sources that changed, and to delete outputs
+    that no page produces any more.
+
+    params:
+        output_path: the directory the site is built into
+    '''
+    file_name = '.manifest.json'
+
+    def __init__(self, output_path):
+        self.path = os.path.join(output_path, self.file_name)
+        self.fingerprint = None
+        self.sources = {}
+        self.signatures = {}
+        self.outputs = []
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            return self
+
+        self.fingerprint = data['fingerprint']
+        self.sources = data['sources']
+        self.signatures = dict(
+            (path, tuple(signature))
+            for path, signature in data['signatures'].items()
+        )
+        self.lookups = data.get('lookups', {})
+        self.outputs = data['outputs']
+        return self
+
+    def save(self):
+        write_to_file(self.path, json.dumps({
+            'fingerprint': self.fingerprint,
+            'sources': self.sources,
+            'signatures': self.signatures,
+            'lookups': self.lookups,
+            'outputs': self.outputs,
+        }))
+
+    def outdated_pages(self, site):
+        '''Find the pages that have to be rendered to bring the output up to
+        date with the site.
+
+        returns:
+            a list of pages, or None if every page has to be rendered
+        '''
+        if self.fingerprint != fingerprint(site):
+            return None
+
+        sources = source_files(site)
+        if set(sources) != set(self.sources):
+            return None
+
+        changed = [p for p in sources if self._changed(site, p)]
+        pages = []
+        if changed:
+            dependencies = Dependencies(site, self.signatures, self.lookups)
+            pages = dependencies.affected(changed)
+            if pages is None:
+                return None
+
+        outdated = set(pages)
+        missing = [
+            p for p in site.pages
+            if p not in outdated
+            and not p.no_render
+            and not os.path.isfile(p.output_path)
+        ]
+        return pages + missing
+
+    def record(self, site):
+        '''Record the site as built, deleting outputs from the last build
+        that the site no longer produces.
+        '''
+        outputs = output_files(site)
+        for path in set(self.outputs) - set(outputs):
+            if os.path.isfile(path):
+                os.remove(path)
+
+        sources = {}
+        for path in source_files(site):
+            mtime, size = _stat(site, path)
+            old = self.sources.get(path)
+            if old and (old['mtime'], old['size']) == (mtime, size):
+                source_hash = old['hash']
+            else:
+                source_hash = file_hash(path)
+            sources[path] = {'mtime': mtime, 'size': size, 'hash': source_hash}
+
+        self.fingerprint = fingerprint(site)
+        self.sources = sources
+        self.signatures = Dependencies(site).signatures
+        urls = set(p.url for p in site.pages)
+        self.lookups = dict(
+            (url, sorted(paths))
+            for url, paths in site.lookups.items()
+            if paths and url in urls
+        )
+        self.outputs = outputs
+
+    def _changed(self, site, path):
+        old = self.sources.get(path)
+        if old is None:
+            return True
+        if (old['mtime'], old['size']) == _stat(site, path):
+            return False
+        return file_hash(path) != old['hash']
@@ -1,17 +1,35 @@
 from __future__ import absolute_import
 
 import os
+from contextlib import contextmanager
 
-from ..utils import copy_attrs, cached_property
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+
+from ..utils import (
+    DirectoryIndex,
+    cached_property,
+    copy_attrs,
+    ensure_directory_exists,
+)
 from ..category import Category
+from ..profiler import NullProfiler, Profiler
+from .dependencies import Dependencies
 from .sitemap import Sitemap
 from .writer import Writer
 
 
 class Site(object):
     _cache = None
-
-    def __init__(self, settings, client_js_code='', include_drafts=False):
+    _template_env = None
+    _rendering = None
+
+    def __init__(
+        self,
+        settings,
+        client_js_code='',
+        include_drafts=False,
+        profile=False,
+    ):
         '''A staticpy Site Object
 
         params:
@@ -19,22 +37,71 @@ class Site(object):
                 - input_path: the full directory to the websites files
                 - output_path: where you want the resulting files to go
                 - base_url: the url where your website is hosted
+                - template_cache_path: (optional) a directory to store
+                    compiled template bytecode between builds
+                - scan_threads: (optional) the number of threads used to
+                    walk the pages directory
+                - precompress: (optional) write gzipped copies of the
+                    output for the dev server and uploader to send
+                - precompress_min_size: (optional) the smallest file, in
+                    bytes, worth compressing
             client_js_code: A piece of JS to communicate with the server
             include_drafts: Include pages that have not been published
+            profile: Time the phases of the build in site.profiler
 
         '''
         copy_attrs(self, settings, 'input_path', 'output_path', 'base_url')
+        self.template_cache_path = getattr(
+            settings,
+            'template_cache_path',
+            None,
+        )
+        self.scan_threads = getattr(settings, 'scan_threads', 1)
+        self.precompress = getattr(settings, 'precompress', False)
+        self.precompress_min_size = getattr(
+            settings,
+            'precompress_min_size',
+            1024,
+        )
 
         self.client_js_code = client_js_code
         self.include_drafts = include_drafts
+        self.profiler = Profiler() if profile else NullProfiler()
         self.writer = Writer(self, self.output_path)
 
-    def save(self):
-        self.writer.write()
+        # The url of each rendered page to the source files of the pages its
+        # templates looked up with page_at or url_for.
+        self.lookups = {}
+
+    def save(self, jobs=1):
+        '''Write the whole site
+
+        params:
+            jobs: the number of processes to render pages with
+        returns:
+            a Counter of the files 'written' and 'skipped' as unchanged
+        '''
+        return self.writer.write(jobs)
+
+    def recompile(self, paths=None):
+        '''Rebuild the site after its source files change
 
-    def recompile(self):
-        self.bust_cache()
-        self.save()
+        params:
+            paths: the source files that changed, if given and the change
+                can be scoped we only re-render the pages that depend on
+                them, otherwise the whole site is rebuilt.
+        returns:
+            the re-rendered pages, or None after a full rebuild
+        '''
+        pages = self.dependencies.affected(paths) if paths else None
+        if pages is None:
+            self.bust_cache()
+            self.save()
+        else:
+            for path in paths:
+                self.tree.forget(path)
+            self.writer.write_pages(pages)
+        return pages
 
     def bust_cache(self):
         self._cache = None
@@ -49,9 +116,49 @@ class Site(object):
         links = [p for p in self.pages if p.include_in_navigation]
         return sorted(links, key=lambda x: x.order)
 
+    @cached_property
+    def pages_by_url(self):
+        return dict((p.url, p) for p in self.pages)
+
+    def page_at(self, path):
+        '''Find the page at a url path
+
+        Pages found while another page renders are recorded in lookups, so
+        the rendered page is rebuilt when the page it found changes.
+
+        params:
+            path: a path such as '/', 'blog' or '/blog/a-post'
+        returns: a page, or None
+        '''
+        page = self.pages_by_url.get('/' + path.strip('/'))
+        if page is not None and self._rendering is not None:
+            self.lookups[self._rendering.url].add(page.file_path)
+        return page
+
+    def url_for(self, path):
+        '''The url of the page at path, raising ValueError if there is none
+
+        Unlike writing out the url this fails the build on broken links.
+        '''
+        page = self.page_at(path)
+        if page is None:
+            raise ValueError('No page at %s' % path)
+        return page.url
+
+    @contextmanager
+    def rendering(self, page):
+        '''Record the pages looked up while page renders'''
+        self.lookups[page.url] = set()
+        self._rendering = page
+        try:
+            yield
+        finally:
+            self._rendering = None
+
     @cached_property
     def pages(self):
-        return self.base.sub_pages
+        with self.profiler.phase('parse'):
+            return self.base.sub_pages
 
     @cached_property
     def categories(self):
@@ -59,10 +166,47 @@ class Site(object):
 
     @cached_property
     def base(self):
-        return Category(
-            self,
-            os.path.join(self.input_path, 'dynamic', 'pages'),
-        )
+        return Category(self, self.tree.path)
+
+    @cached_property
+    def tree(self):
+        with self.profiler.phase('scan'):
+            return DirectoryIndex(
+                os.path.join(self.input_path, 'dynamic', 'pages'),
+                self.scan_threads,
+            )
+
+    @property
+    def template_env(self):
+        '''The jinja Environment shared by every page render
+
+        Templates are compiled once and kept in the environment's cache,
+        which survives bust_cache (jinja reloads templates that change on
+        disk).  If a template_cache_path is configured the compiled bytecode
+        is also stored on disk so later builds can skip compilation.
+
+        Templates can look pages up with page_at(path) and url_for(path).
+        '''
+        if self._template_env is None:
+            self._template_env = Environment(
+                loader=PackageLoader('dynamic', 'templates'),
+                bytecode_cache=self._bytecode_cache(),
+            )
+            self._template_env.globals.update(
+                page_at=self.page_at,
+                url_for=self.url_for,
+            )
+        return self._template_env
+
+    def _bytecode_cache(self):
+        if not self.template_cache_path:
+            return None
+        ensure_directory_exists(self.template_cache_path)
+        return FileSystemBytecodeCache(self.template_cache_path)
+
+    @cached_property
+    def dependencies(self):
+        return Dependencies(self)
 
     @cached_property
     def sitemap(self):
@@ -1,31 +1,170 @@
 from __future__ import absolute_import
 
 import os
+from functools import partial
+from itertools import islice
+from xml.sax.saxutils import escape
 
-from jinja2 import Environment, PackageLoader
+from jinja2 import TemplateNotFound
 
-from ..utils import write_to_file
+from ..utils import buffered, gzip_chunks, read_chunks, write_to_file
+
+URLSET_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<urlset
+    xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9
+      http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">
+'''
+
+URLSET_FOOTER = '</urlset>\n'
+
+URL = '''  <url>
+  <loc>{loc}</loc>
+  <lastmod>{lastmod}</lastmod>
+  <changefreq>{changefreq}</changefreq>
+  </url>
+'''
+
+INDEX_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+'''
+
+INDEX_FOOTER = '</sitemapindex>\n'
+
+SITEMAP = '''  <sitemap>
+  <loc>{loc}</loc>
+  </sitemap>
+'''
+
+
+def _split(sizes, max_urls, max_size):
+    '''Plan the sitemap files for entries of the given sizes
+
+    Each file ends before it goes over max_urls entries or max_size bytes.
+
+    returns: the number of entries in each file
+    '''
+    counts = []
+    count, size = 0, len(URLSET_HEADER) + len(URLSET_FOOTER)
+    for entry_size in sizes:
+        if count and (count >= max_urls or size + entry_size > max_size):
+            counts.append(count)
+            count, size = 0, len(URLSET_HEADER) + len(URLSET_FOOTER)
+        count += 1
+        size += entry_size
+    counts.append(count)
+    return counts
+
+
+def _urlset(entries):
+    yield URLSET_HEADER
+    for entry in entries:
+        yield entry
+    yield URLSET_FOOTER
 
 
 class Sitemap(object):
+    '''Write the site's sitemap into the static directory
+
+    Entries are streamed into static/sitemap.xml.  Search engines limit a
+    sitemap to 50,000 urls and 50MB, a site over those limits is split into
+    static/sitemap-1.xml, static/sitemap-2.xml... and sitemap.xml becomes a
+    sitemap index listing them.  Every file is written with a gzipped .gz
+    copy next to it.
+
+    A site with its own templates/sitemap.html keeps using it: each
+    sitemap file is that template rendered with the file's pages and the
+    site's base_url.  Its output size is not known before rendering, so
+    those sitemaps are only split by max_urls.
+    '''
+    max_urls = 50000
+    max_size = 50 * 1024 * 1024
+    template_name = 'sitemap.html'
+
     def __init__(self, site):
-        self.env = Environment(loader=PackageLoader('dynamic', 'templates'))
         self.site = site
+        self.paths = []
 
     def write(self):
-        template = self.env.get_template('sitemap.html')
-        file_path = os.path.join(
+        '''returns: True if any sitemap file changed'''
+        self.paths = []
+        template = self._template()
+        if template is None:
+            sizes = (len(x) for x in self._entries())
+            items = self._entries()
+            render = _urlset
+        else:
+            sizes = (0 for _ in self.pages)
+            items = iter(self.pages)
+            render = partial(self._render, template)
+
+        parts = _split(sizes, self.max_urls, self.max_size)
+        if len(parts) == 1:
+            return self._write(self.path, render(items))
+
+        # Too big for one file, every part is written straight to its own
+        # file and sitemap.xml only ever holds the index
+        written = False
+        for number, count in enumerate(parts, 1):
+            part = render(islice(items, count))
+            written |= self._write(self._part_path(number), part)
+        written |= self._write(self.path, self._index(len(parts)))
+        return written
+
+    @property
+    def path(self):
+        return os.path.join(
             self.site.output_path,
             'static',
             'sitemap.xml'
         )
-        site_map = template.render(
-            pages=self.pages,
-            base_url=self.site.base_url
-        )
-
-        write_to_file(file_path, site_map)
 
     @property
     def pages(self):
-        return [p for p in self.site.pages if p.sitemap]
+        return self.site.sitemap_links
+
+    def _template(self):
+        try:
+            return self.site.template_env.get_template(self.template_name)
+        except TemplateNotFound:
+            return None
+
+    def _render(self, template, pages):
+        return buffered(template.generate(
+            pages=list(pages),
+            base_url=self.site.base_url,
+        ))
+
+    def _write(self, path, chunks):
+        written = write_to_file(path, chunks)
+        if written or not os.path.isfile(path + '.gz'):
+            write_to_file(path + '.gz', gzip_chunks(read_chunks(path)))
+        self.paths.extend([path, path + '.gz'])
+        return written
+
+    def _part_path(self, number):
+        return os.path.join(
+            self.site.output_path,
+            'static',
+            'sitemap-%s.xml' % number,
+        )
+
+    def _url(self, path):
+        return escape(self.site.base_url + path)
+
+    def _entries(self):
+        for page in self.pages:
+            yield URL.format(
+                loc=self._url(page.url),
+                lastmod=page.last_modified.strftime('%Y-%m-%d'),
+                changefreq=escape(page.change_frequency or 'weekly'),
+            )
+
+    def _index(self, parts):
+        yield INDEX_HEADER
+        for number in xrange(1, parts + 1):
+            yield SITEMAP.format(
+                loc=self._url('/static/sitemap-%s.xml.gz' % number),
+            )
+        yield INDEX_FOOTER
@@ -1,8 +1,16 @@
 from __future__ import absolute_import
 
 import os
+from collections import Counter
+from multiprocessing import Pool
 
+from ..compression import Compressor
 from ..utils import ensure_directory_exists
+from .manifest import Manifest
+
+# The site being written in parallel, worker processes are forked with it
+# so they share the parent's parsed page tree and template environment.
+_worker_site = None
 
 
 def _create_category_directories(output_path, categories):
@@ -12,18 +20,144 @@ def _create_category_directories(output_path, categories):
         )
 
 
+def _tally(counts, written):
+    if written is not None:
+        counts['written' if written else 'skipped'] += 1
+
+
+def _write_pages(pages):
+    '''Write pages, counting the files written and the unchanged ones'''
+    counts = Counter()
+    for page in pages:
+        _tally(counts, page.write())
+    return counts
+
+
+def _write_worker_pages(indexes):
+    profiler = _worker_site.profiler = type(_worker_site.profiler)()
+    lookups = _worker_site.lookups = {}
+    pages = _worker_site.pages
+    counts = _write_pages(pages[i] for i in indexes)
+    return counts, profiler, lookups
+
+
+def _partition(items, jobs):
+    '''Split items into contiguous chunks, a few per job so a worker that
+    drew slow pages does not hold up the rest.
+    '''
+    size = max(1, len(items) // (jobs * 4))
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
 class Writer(object):
     def __init__(self, site, output_path):
         self.site = site
         self.output_path = output_path
 
-    def write(self):
+    def write(self, jobs=1):
+        '''Bring the output directory up to date with the site
+
+        The manifest of the last build into the output directory tells us
+        which pages are out of date, only those are rendered.
+
+        returns: a Counter of the files 'written' and 'skipped', and
+            'compressed' if the site is precompressed
+        '''
         _create_category_directories(
             self.output_path,
             self.site.categories,
         )
 
-        for page in self.site.pages:
-            page.write()
+        manifest = Manifest(self.output_path).load()
+        pages = manifest.outdated_pages(self.site)
+        if pages is None:
+            pages = self.site.pages
+        else:
+            # Pages that are not rendered again keep their lookups
+            for url, paths in manifest.lookups.items():
+                self.site.lookups.setdefault(url, set(paths))
+
+        if jobs > 1:
+            counts = self._write_in_parallel(pages, jobs)
+            self._write_sitemap(counts)
+        else:
+            counts = self._write_pages(pages)
+
+        rendered = set(pages)
+        counts['skipped'] += len([
+            p for p in self.site.pages
+            if p not in rendered and not p.no_render
+        ])
+
+        self._finish(manifest, counts)
+        return counts
+
+    def write_pages(self, pages):
+        '''Write only the given pages, after a change scoped to them
+
+        The manifest is brought up to date and the output recompressed just
+        as after a full write, so the next build knows these pages are
+        current.
+
+        returns: a Counter of the files 'written' and 'skipped'
+        '''
+        counts = self._write_pages(pages)
+        self._finish(Manifest(self.output_path).load(), counts)
+        return counts
+
+    def _write_pages(self, pages):
+        counts = _write_pages(pages)
+        self._write_sitemap(counts)
+        return counts
+
+    def _finish(self, manifest, counts):
+        manifest.record(self.site)
+        manifest.save()
+        self._compress(counts)
+
+    def _write_sitemap(self, counts):
+        with self.site.profiler.phase('sitemap'):
+            _tally(counts, self.site.sitemap.write())
+
+    def _compress(self, counts):
+        if not self.site.precompress:
+            return
+        compressor = Compressor(
+            self.output_path,
+            self.site.precompress_min_size,
+        )
+        with self.site.profiler.phase('compress'):
+            counts['compressed'] += compressor.compress()
+
+    def _write_in_parallel(self, pages, jobs):
+        '''Render and write pages across jobs worker processes
+
+        The workers are forked from this process, so they start with the
+        page tree already parsed and pages are handed out by their index in
+        site.pages.  The templates are compiled here first so every worker
+        inherits them, and template errors are raised once.
+        '''
+        global _worker_site
+
+        positions = dict((p, i) for i, p in enumerate(self.site.pages))
+        indexes = [positions[p] for p in pages]
+        for name in set(p.template_name for p in pages if not p.no_render):
+            self.site.template_env.get_template(name)
 
-        self.site.sitemap.write()
+        _worker_site = self.site
+        pool = Pool(processes=jobs)
+        try:
+            results = pool.map(
+                _write_worker_pages,
+                _partition(indexes, jobs),
+            )
+            counts = Counter()
+            for worker_counts, profiler, lookups in results:
+                counts.update(worker_counts)
+                self.site.profiler.merge(profiler)
+                self.site.lookups.update(lookups)
+            return counts
+        finally:
+            pool.close()
+            pool.join()
+            _worker_site = None
@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 
-import Queue
+import os
+import json
+import time
+import errno
 import socket
+import select
 import threading
 import hashlib
-from struct import pack
+from struct import pack, unpack
 
 from .utils import logger
 
@@ -21,12 +25,33 @@ client_js_code = '''
             server = new WebSocket("ws://%s:%s/");
             server.onopen = function(e) {
                 document.title = 'MONITORING';
+                server.send(JSON.stringify({url: document.location.pathname}));
                 server.onclose = function(e) {
                     document.title = 'Connection Lost';
                 };
             };
             server.onclose = function(e) { connect() };
-            server.onmessage = function(e) {document.location.reload(true); };
+            server.onmessage = function(e) {
+                var message = JSON.parse(e.data);
+                if (message.css) {
+                    swap_stylesheets(message.css);
+                } else {
+                    document.location.reload();
+                }
+            };
+        }
+
+        // Reload the stylesheets at paths without reloading the page
+        function swap_stylesheets(paths) {
+            var links = document.querySelectorAll('link[rel="stylesheet"]');
+            for (var i = 0; i < links.length; i++) {
+                var url = document.createElement('a');
+                url.href = links[i].href;
+                if (paths.indexOf(url.pathname) !== -1) {
+                    url.search = 'reload=' + new Date().getTime();
+                    links[i].href = url.href;
+                }
+            }
         }
 
         //this should modified to make it work in i.e.
@@ -35,26 +60,86 @@ client_js_code = '''
 '''
 
 
-def frame_message(message):
-    '''Frame a message for transmission
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xa
 
-    For a message to be sent across the socket it must be for formatted
-    in the form <opcode><length><message>.
 
-    This function takes care of that.
+def page_url(path):
+    '''The url of the page a browser showing path is on'''
+    if path.endswith('.html'):
+        path = path[:-len('.html')]
+    if path.endswith('/index'):
+        path = path[:-len('index')]
+    return path.rstrip('/') or '/'
 
-    params: message string
-    return: framed message string
+
+def frame(opcode, payload=''):
+    '''Frame a payload for transmission
+
+    A frame is <fin + opcode><length><payload>, the length takes 1, 3 or 9
+    bytes depending on its size.  Frames from the server are not masked.
+
+    params: opcode, payload string
+    return: framed payload string
     '''
-    length = len(message)
+    length = len(payload)
     if length > 0xffff:
         length = "\x7f%s" % pack(">Q", length)
     elif length > 0x7d:
         length = "\x7e%s" % pack(">H", length)
     else:
-        length = chr(len(message))
+        length = chr(length)
+
+    return "%s%s%s" % (chr(0x80 | opcode), length, payload)
+
+
+def frame_message(message):
+    '''Frame a text message for transmission
+
+    params: message string
+    return: framed message string
+    '''
+    return frame(OPCODE_TEXT, message)
 
-    return "%s%s%s" % (chr(0x81), length, message)
+
+def read_frame(buffer):
+    '''Read the first frame in a buffer of data from a client
+
+    Frames from clients are always masked, the payload is unmasked here.
+
+    params: buffer string
+    returns: (opcode, payload, rest of buffer), or None if the buffer does
+        not hold a whole frame yet
+    '''
+    if len(buffer) < 2:
+        return None
+    opcode = ord(buffer[0]) & 0x0f
+    length = ord(buffer[1]) & 0x7f
+    masked = ord(buffer[1]) & 0x80
+    start = 2
+    if length == 0x7e:
+        if len(buffer) < 4:
+            return None
+        length, = unpack(">H", buffer[2:4])
+        start = 4
+    elif length == 0x7f:
+        if len(buffer) < 10:
+            return None
+        length, = unpack(">Q", buffer[2:10])
+        start = 10
+
+    mask = buffer[start:start + 4] if masked else '\x00' * 4
+    start += 4 if masked else 0
+    if len(buffer) < start + length:
+        return None
+
+    payload = bytearray(buffer[start:start + length])
+    mask = bytearray(mask)
+    for i in xrange(len(payload)):
+        payload[i] ^= mask[i % 4]
+    return opcode, str(payload), buffer[start + length:]
 
 
 def parse_key(request):
@@ -114,14 +199,14 @@ def generate_response(key):
 
 
 class WebSocket(object):
-    ''' WebSocket server worker
-
-    This class operates as a one way server "worker" on creation
-    we read the connection request of the supplied socket and issue
-    the correct response to start the connection.
+    ''' WebSocket server side of a connection
 
-    Once the object has been created it can be used to send messages
-    to the client, however it cannot receive anything.
+    The socket is non-blocking, the SocketServer hands everything it reads
+    to feed() and writes out what is waiting in outgoing when the socket
+    is writable.  The first thing read is the connection request, which
+    is answered to open the connection, after that we read frames.  The
+    client's page sends {"url": <its path>} once it connects, which we
+    keep as url.
 
     Note: This does not handle the older style of websocket that uses key-1
     and key-2.  I have only tested this on: iOS 6 (iphone/ipad), Chrome 24,
@@ -132,54 +217,81 @@ class WebSocket(object):
     '''
     def __init__(self, sock):
         self.sock = sock
-        self.connect()
+        self.sock.setblocking(False)
+        self.open = False
+        self.closed = False
+        self.incoming = ''
+        self.outgoing = ''
+        self.url = None
+        self.last_seen = time.time()
 
-    def connect(self):
-        '''Connect to a WebSocket client
+    def fileno(self):
+        return self.sock.fileno()
 
-        This function does everything necessary to negotiate a
-        connection with a new WebSocket client.
+    def feed(self, data):
+        '''Handle data read from the client
 
-        params: None
-        '''
-        request = self.sock.recv(4096)
-        self.key = parse_key(request)
-        response = generate_response(self.key)
-        self.sock.send(response)
-
-    def send(self, message):
-        '''Send a message
-
-        Send a message to the connected client.
-
-        params: message
-        return:
-            1 on success
-            0 on failure
+        returns: the text messages the client sent
         '''
+        self.last_seen = time.time()
+        self.incoming += data
+        if not self.open:
+            if '\r\n\r\n' not in self.incoming:
+                return []
+            request, self.incoming = self.incoming.split('\r\n\r\n', 1)
+            self.key = parse_key(request)
+            self.queue(generate_response(self.key))
+            self.open = True
+
+        messages = []
+        while True:
+            read = read_frame(self.incoming)
+            if read is None:
+                return messages
+            opcode, payload, self.incoming = read
+            if opcode == OPCODE_TEXT:
+                messages.append(payload)
+            elif opcode == OPCODE_PING:
+                self.queue(frame(OPCODE_PONG, payload))
+            elif opcode == OPCODE_CLOSE:
+                self.closed = True
+                return messages
+
+    def queue(self, data):
+        self.outgoing += data
+
+    def flush(self):
+        '''Write as much of outgoing as the socket takes without blocking'''
         try:
-            self.sock.send(frame_message(message))
-            return True
-        except:
-            logger.error('error writing to socket')
-            return False
+            sent = self.sock.send(self.outgoing)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.outgoing = self.outgoing[sent:]
 
     def close(self):
         self.sock.close()
 
-    def __delete__(self):
-        self.close()
-
 
 class SocketServer(threading.Thread):
-    '''A simple threaded WebSocketServer
-
-        A very simple websocket server, once initialized we bind the socket
-        and sit and wait for a connection.  When a new client tries to connect
-        we create a WebSocket object and accept the connection.  The newly
-        created WebSocket is placed on the queue expecting the parent process
-        to handle it.
+    '''A threaded WebSocket server broadcasting updates to every client
+
+        One thread runs a select() loop over the listening socket and every
+        client, nothing blocks: new connections are accepted and their
+        handshakes answered as their data arrives, and each client has its
+        own outgoing buffer written as the socket allows.
+
+        broadcast() can be called from any thread, the message is framed
+        once and queued for every open client (or only the clients showing
+        one of a list of urls), a pipe wakes the loop up to send it.
+        Clients are pinged every ping_interval seconds, clients that have
+        not answered for two intervals, or that fall more than max_buffer
+        bytes behind, are dropped.
     '''
+    ping_interval = 10
+    max_buffer = 1024 * 1024
+
     def __init__(self, host='localhost', port=8888):
         '''WebSocketServer initializer
 
@@ -189,33 +301,141 @@ class SocketServer(threading.Thread):
             port: the port to try to connect on.  If this fails
                 we will try to bind to 10 higher ports until we are successful.
         '''
-        self.queue = Queue.Queue()
-
         threading.Thread.__init__(self)
         self.daemon = True
         self.sock = self.bind(host, port)
+        self.sock.listen(64)
+        self.sock.setblocking(False)
         self.client_js_code = client_js_code % (self.host, self.port)
+        self.clients = set()
+        self.running = True
+        self._messages = []
+        self._lock = threading.Lock()
+        self._wakeup, self._waker = os.pipe()
 
     def start(self):
         super(SocketServer, self).start()
         return self
 
+    def stop(self):
+        self.running = False
+        os.write(self._waker, 'x')
+
+    def broadcast(self, message, urls=None):
+        '''Send a message to connected clients, from any thread
+
+        params:
+            message: the message string
+            urls: only send it to the clients showing one of these page
+                urls, by default it goes to every client
+        '''
+        if urls is not None:
+            urls = set(page_url(x) for x in urls)
+        with self._lock:
+            self._messages.append((message, urls))
+        os.write(self._waker, 'x')
+
     def run(self):
         '''Run server
 
-        Start Listen on the specified socket.  When a new connection
-        is made we accept it and place it on the queue, and start waiting again
-
-        The thread can be stopped by turning off self.running.
+        Listen on the socket and serve clients until stop() is called.
 
         params: nothing
         return: nothing
         '''
-        self.running = True
-        self.sock.listen(1)
+        last_ping = time.time()
         while self.running:
-            t, _ = self.sock.accept()
-            self.queue.put(WebSocket(t))
+            clients = list(self.clients)
+            writers = [c for c in clients if c.outgoing]
+            readable, writable, _ = select.select(
+                [self.sock, self._wakeup] + clients,
+                writers,
+                [],
+                self.ping_interval,
+            )
+
+            for sock in readable:
+                if sock is self.sock:
+                    self._accept()
+                elif sock is self._wakeup:
+                    os.read(self._wakeup, 4096)
+                    self._send_messages()
+                elif sock in self.clients:
+                    self._read(sock)
+
+            for client in writable:
+                if client in self.clients:
+                    self._write(client)
+
+            if time.time() - last_ping >= self.ping_interval:
+                self._ping()
+                last_ping = time.time()
+
+        for client in list(self.clients):
+            self._drop(client)
+        self.sock.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self.sock.accept()
+        except socket.error:
+            return
+        self.clients.add(WebSocket(sock))
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+            if not data:
+                raise socket.error('connection closed')
+            for message in client.feed(data):
+                self._register(client, message)
+        except Exception:
+            self._drop(client)
+            return
+        if client.closed:
+            self._drop(client)
+
+    def _register(self, client, message):
+        try:
+            client.url = page_url(json.loads(message)['url'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning('Unexpected message: {message}', message=message)
+
+    def _write(self, client):
+        try:
+            client.flush()
+        except socket.error:
+            self._drop(client)
+
+    def _send_messages(self):
+        with self._lock:
+            messages, self._messages = self._messages, []
+        for message, urls in messages:
+            framed = frame_message(message)
+            for client in list(self.clients):
+                if not client.open:
+                    continue
+                if urls is None or client.url in urls:
+                    self._queue(client, framed)
+
+    def _queue(self, client, data):
+        if len(client.outgoing) + len(data) > self.max_buffer:
+            self._drop(client)
+        else:
+            client.queue(data)
+
+    def _ping(self):
+        ping = frame(OPCODE_PING)
+        oldest = time.time() - 2 * self.ping_interval
+        for client in list(self.clients):
+            if client.last_seen < oldest:
+                self._drop(client)
+            elif client.open:
+                self._queue(client, ping)
+
+    def _drop(self, client):
+        self.clients.discard(client)
+        client.close()
 
     def bind(self, host, port):
         '''Bind to a socket
@@ -238,6 +458,7 @@ class SocketServer(threading.Thread):
         for i in range(10):
             try:
                 sock.bind((self.host, self.port))
+                self.port = sock.getsockname()[1]
                 logger.success(
                     'Listening at {host}:{port}',
                     host=self.host,
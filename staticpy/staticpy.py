@@ -1,23 +1,43 @@
 from __future__ import absolute_import
 
 import os
+import sys
 import argparse
+from contextlib import contextmanager
 from functools import wraps
 
 from .utils import init_output_dir, load_settings, logger
-from .s3_uploader import upload_to_s3
+from .s3_uploader import MULTIPART_THRESHOLD, upload_to_s3
 from .site import Site
 from .socket_server import SocketServer
 from .web_server import WebServer
-from .file_monitor import monitor_site
+from .file_monitor import QUIET_PERIOD, monitor_site
+from .profiler import profile_to_file
 
 
-def _compile_site(settings, client_js_code='', dev=False):
-    site = Site(settings, client_js_code, dev)
+@contextmanager
+def _profile(path):
+    if path:
+        with profile_to_file(path):
+            yield
+    else:
+        yield
+
+
+def _compile_site(settings, args, client_js_code='', dev=False):
+    profile = bool(args.profile or args.profile_output)
+    site = Site(settings, client_js_code, dev, profile)
     logger.info('Compiling Site: {path}', path=settings.input_path)
     logger.info('Output: %s' % settings.output_path)
-    site.save()
-    logger.success('Done Compiling')
+    with _profile(args.profile_output):
+        counts = site.save(args.jobs)
+    logger.success(
+        'Done Compiling: {written} files written, {skipped} unchanged',
+        written=counts['written'],
+        skipped=counts['skipped'],
+    )
+    if profile:
+        site.profiler.report()
     return site
 
 
@@ -36,36 +56,74 @@ def parse_args_and_load_settings(func):
             help="The path to the to your website's data",
         )
 
-        site_path = parser.parse_args().site_path
-        site_path = os.path.abspath(site_path)
+        parser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help='The number of processes used to render pages',
+        )
+
+        parser.add_argument(
+            '--clean',
+            action='store_true',
+            help='Delete the output of earlier builds and build from scratch',
+        )
+
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Report the time spent in each phase and template',
+        )
+
+        parser.add_argument(
+            '--profile-output',
+            metavar='PATH',
+            help='Run the build under cProfile and write the stats to PATH',
+        )
+
+        args = parser.parse_args()
+        site_path = os.path.abspath(args.site_path)
         settings = load_settings(site_path)
-        init_output_dir(site_path, settings.output_path)
-        func(settings)
+        init_output_dir(site_path, settings.output_path, args.clean)
+        func(settings, args)
     return wrapped
 
 
 @parse_args_and_load_settings
-def develop(settings):
+def develop(settings, args):
 
-    socket_server = SocketServer().start()
+    socket_server = SocketServer()
 
-    WebServer(settings.output_path).start()
+    # --jobs forks render workers, compile before the servers start their
+    # threads so no worker is forked from a process in the middle of
+    # serving.  Recompiles after a change always render in this process.
+    site = _compile_site(settings, args, socket_server.client_js_code, True)
 
+    socket_server.start()
+    web_server = WebServer(settings.output_path).start()
+    web_server.update(site)
     monitor_site(
-        _compile_site(settings, socket_server.client_js_code, True),
-        socket_server.queue
+        site,
+        socket_server,
+        web_server=web_server,
+        quiet_period=getattr(settings, 'monitor_quiet_period', QUIET_PERIOD),
     )
 
 
 @parse_args_and_load_settings
-def upload(settings):
-    _compile_site(settings)
+def upload(settings, args):
+    _compile_site(settings, args)
     if hasattr(settings, 's3_bucket'):
-        upload_to_s3(
+        uploaded = upload_to_s3(
             settings.aws_keys,
             settings.s3_bucket,
             settings.output_path,
+            getattr(settings, 'multipart_threshold', MULTIPART_THRESHOLD),
+            getattr(settings, 'upload_threads', 10),
         )
+        if not uploaded:
+            logger.error('Upload failed, the bucket is only partly updated')
+            sys.exit(1)
     else:
         logger.error("No S3 credentials specified")
 
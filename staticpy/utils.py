@@ -1,9 +1,19 @@
 from __future__ import absolute_import
 
 import os
-from os.path import isdir, isfile
+from os.path import isfile
 import sys
 import shutil
+import zlib
+import hashlib
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5, scandir is a dependency there
+    from scandir import scandir
 
 from .logger import Logger
 
@@ -18,25 +28,28 @@ class DummySettings(object):
         self.output_path = os.path.join(site_path, '.output')
 
 
-def init_output_dir(site_path, output_path):
-    create_output_dir(output_path)
+def init_output_dir(site_path, output_path, clean=False):
+    create_output_dir(output_path, clean)
     link_static(site_path, output_path)
 
 
-def create_output_dir(path):
-    if os.path.exists(path):
+def create_output_dir(path, clean=False):
+    '''Create the output directory
+
+    An existing output directory is kept, along with its build manifest,
+    so the next build only re-renders what changed, unless clean is set.
+    '''
+    if clean and os.path.exists(path):
         shutil.rmtree(path)
-    os.makedirs(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
 
 
 def link_static(site_path, output_path):
-    try:
-        os.symlink(
-            os.path.join(site_path, 'static'),
-            os.path.join(output_path, 'static')
-        )
-    except:
-        print '%s/static already exists' % output_path
+    link = os.path.join(output_path, 'static')
+    if os.path.lexists(link):
+        return
+    os.symlink(os.path.join(site_path, 'static'), link)
 
 
 def copy_attrs(target, source, *attrs):
@@ -87,23 +100,227 @@ def ensure_directory_exists(path):
         os.mkdir(path)
 
 
-def write_to_file(fp, contents):
-    with open(fp, 'w') as output:
-        output.write(contents)
-
-
-def list_directory(path):
-    return [os.path.join(path, f) for f in os.listdir(path)]
-
-
-def list_directories(path):
-    paths = list_directory(path)
-    return [p for p in paths if isdir(p)]
-
-
-def list_files(path):
-    paths = list_directory(path)
-    return [p for p in paths if isfile(p)]
+def read_chunks(path, chunk_size=65536):
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            yield chunk
+
+
+def file_hash(path, chunk_size=65536):
+    md5 = hashlib.md5()
+    for chunk in read_chunks(path, chunk_size):
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def gzip_chunks(chunks, level=9):
+    '''Compress an iterable of strings into gzip format
+
+    The gzip header is written without a timestamp, so compressing the
+    same contents always gives the same bytes and write_to_file can tell
+    the output did not change.
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def buffered(chunks, size=65536):
+    '''Join an iterable of strings into utf-8 encoded chunks of at least
+    size bytes, the last chunk may be smaller.
+    '''
+    pending, pending_size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield b''.join(pending)
+            pending, pending_size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _current_umask():
+    # os.umask can only read the umask by replacing it, read it once at
+    # import rather than racing other threads creating files later.
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _current_umask()
+
+
+def _copy_prefix(source, output, length, chunk_size=65536):
+    source.seek(0)
+    while length > 0:
+        chunk = source.read(min(length, chunk_size))
+        output.write(chunk)
+        length -= len(chunk)
+
+
+class _FileWriter(object):
+    '''Write a file through a temporary file, unless its contents stay
+    the same.
+
+    Each chunk is compared with the same bytes of the existing file, the
+    temporary file is only created once they differ, starting with the
+    prefix that matched.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.existing = open(path, 'rb') if isfile(path) else None
+        self.matched = 0
+        self.output = self.temp_path = None
+
+    def write(self, chunk):
+        if self.output is None and self.existing is not None:
+            if self.existing.read(len(chunk)) == chunk:
+                self.matched += len(chunk)
+                return
+        self._open_output().write(chunk)
+
+    def close(self):
+        '''returns: True if the file was written, False if unchanged'''
+        if self.output is None and self.existing is not None:
+            if not self.existing.read(1):
+                return False
+
+        self._open_output().close()
+        os.chmod(self.temp_path, self._mode())
+        os.rename(self.temp_path, self.path)
+        return True
+
+    def _mode(self):
+        '''The permissions of the file being replaced, or the ones open()
+        would have created a new file with.  mkstemp makes its files private
+        to the user, which would hide the site from a web server.
+        '''
+        if self.existing is not None:
+            return os.fstat(self.existing.fileno()).st_mode & 0o7777
+        return 0o666 & ~_UMASK
+
+    def cleanup(self):
+        if self.existing is not None:
+            self.existing.close()
+        if self.output is not None:
+            self.output.close()
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+    def _open_output(self):
+        if self.output is None:
+            directory, name = os.path.split(self.path)
+            handle, self.temp_path = tempfile.mkstemp(
+                dir=directory,
+                prefix='.%s.' % name,
+            )
+            self.output = os.fdopen(handle, 'wb')
+            if self.matched:
+                _copy_prefix(self.existing, self.output, self.matched)
+        return self.output
+
+
+def write_to_file(fp, contents, chunk_size=65536):
+    '''Write contents to fp, unless fp already holds exactly contents
+
+    contents can be a string or an iterable of strings, such as a jinja
+    template's generate(), which is consumed chunk_size bytes at a time so
+    the whole file never has to be held in memory.  Unchanged contents
+    are detected by comparing them with the existing file as they arrive.
+    Changed contents are written to a temporary file in the same directory
+    and renamed over fp, so nobody reading fp sees a half written file.
+
+    returns: True if the file was written, False if it was unchanged
+    '''
+    if isinstance(contents, basestring):
+        contents = [contents]
+
+    writer = _FileWriter(fp)
+    try:
+        for chunk in buffered(contents, chunk_size):
+            writer.write(chunk)
+        return writer.close()
+    finally:
+        writer.cleanup()
+
+
+class DirectoryIndex(object):
+    '''An in memory index of a directory tree
+
+    The tree is walked once with scandir, so each directory is listed a
+    single time and telling files from directories does not need a stat
+    call on file systems that report entry types.  Stats are taken when
+    first asked for and kept.
+
+    params:
+        path: the root of the tree
+        threads: walk the top level directories in this many threads,
+            which helps on high latency (network) file systems
+    '''
+    def __init__(self, path, threads=1):
+        self.path = path
+        self._directories = {}
+        self._files = {}
+        self._entries = {}
+
+        top_level = self._scan(path)
+        if threads > 1 and len(top_level) > 1:
+            pool = ThreadPool(threads)
+            try:
+                pool.map(self._walk, top_level)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for directory in top_level:
+                self._walk(directory)
+
+    def directories(self, path):
+        return self._directories.get(path, [])
+
+    def files(self, path):
+        return self._files.get(path, [])
+
+    def walk(self):
+        '''Yield the path of every file in the tree'''
+        for files in self._files.values():
+            for path in files:
+                yield path
+
+    def stat(self, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            return os.stat(path)
+        return entry.stat()
+
+    def forget(self, path):
+        '''Drop the stat kept for a file that changed, it is taken again
+        the next time it is asked for.
+        '''
+        self._entries.pop(path, None)
+
+    def _walk(self, path):
+        for directory in self._scan(path):
+            self._walk(directory)
+
+    def _scan(self, path):
+        directories, files = [], []
+        for entry in scandir(path):
+            if entry.is_dir():
+                directories.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+                self._entries[entry.path] = entry
+
+        self._directories[path] = directories
+        self._files[path] = files
+        return directories
 
 
 def walk_directory(source_path):
@@ -1,52 +1,237 @@
 from __future__ import absolute_import
 
+import BaseHTTPServer
 import SimpleHTTPServer
 import SocketServer
 import socket
 import os
+import posixpath
 import threading
+import urllib
+import urlparse
+from email.utils import formatdate, mktime_tz, parsedate_tz
 
-from .utils import logger
+from .compression import Compressor, compressed_copy
+from .utils import file_hash, logger
+
+
+def _accepts_gzip(header):
+    '''Whether an Accept-Encoding header allows a gzipped response'''
+    for coding in header.split(','):
+        parts = [x.strip() for x in coding.split(';')]
+        if parts[0] not in ('gzip', '*'):
+            continue
+        if 'q=0' not in parts[1:] and 'q=0.0' not in parts[1:]:
+            return True
+    return False
+
+
+def _modified_since(header, mtime):
+    '''Whether a file modified at mtime is newer than an If-Modified-Since
+    header, or True if the header can not be parsed.
+    '''
+    date = parsedate_tz(header)
+    if date is None:
+        return True
+    return int(mtime) > mktime_tz(date)
+
+
+class ETags(object):
+    '''The content hashes of the files served, used as their ETags
+
+    A file is hashed the first time it is served and again only when its
+    size or mtime change.  Builds leave the outputs they did not change
+    untouched, so after a rebuild most files keep their hash.  Hashes the
+    build already computed (the precompression index) are used as they
+    are.
+    '''
+    def __init__(self):
+        self.hashes = {}
+
+    def get(self, path, stat):
+        key = (stat.st_mtime, stat.st_size)
+        cached = self.hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        content_hash = file_hash(path)
+        self.hashes[path] = (key, content_hash)
+        return content_hash
+
+    def update(self, root):
+        '''Take the hashes recorded by the last build into root'''
+        for relative, entry in Compressor(root).load().items():
+            self.hashes[os.path.join(root, relative)] = (
+                (entry['mtime'], entry['size']),
+                entry['hash'],
+            )
+
+
+class Routes(object):
+    '''Map request paths to the files in the output directory
+
+    Page urls are looked up in a table built from the site's pages:
+        routes '/' -> index.html
+        routes '/path/to/page' -> /path/to/page.html
+        routes '/category' -> /category/index.html
+    Any other path is a file under root, such as /static/style.css.
+
+    The table is replaced as a whole by update, so request threads never
+    see one half built.
+
+    params:
+        root: the output directory
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.pages = {}
+
+    def update(self, site):
+        self.pages = dict(
+            (page.url, page.output_path)
+            for page in site.pages
+            if not page.no_render
+        )
+
+    def resolve(self, path):
+        '''returns: the file to serve for a request path'''
+        path = urllib.unquote(urlparse.urlsplit(path).path)
+        page = self.pages.get(path.rstrip('/') or '/')
+        if page is not None:
+            return page
+
+        parts = posixpath.normpath(path).split('/')
+        parts = [x for x in parts if x and x not in (os.curdir, os.pardir)]
+        return os.path.join(self.root, *parts)
 
 
 class TestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     '''A basic request TestHandler
 
-    Two unique rules:
-        routes '/' -> index.html
-        rounts '/path/to/page' -> /path/to/page.html'
+    Paths are resolved to files by the server's Routes.  Connections are
+    kept alive between requests (HTTP/1.1), so a page's assets come down
+    the same connection.
+
+    Files with an up to date precompressed copy are sent gzipped to
+    clients that accept it.  Conditional requests (If-None-Match and
+    If-Modified-Since) for unchanged files are answered with a 304.
 
     This disables logging
     '''
-    def do_GET(self):
-        if self.path == '/':
-            self.path = 'index.html'
-        elif os.path.isfile('%s.html' % self.path.strip('\\/')):
-            self.path = '%s.html' % self.path
+    protocol_version = 'HTTP/1.1'
+
+    def translate_path(self, path):
+        return self.server.routes.resolve(path)
+
+    def send_head(self):
+        '''Send the headers for a GET or HEAD request
+
+        Responses carry an ETag and Last-Modified and are sent with
+        Cache-Control: no-cache, so the browser asks for every file again
+        on a reload and we answer 304 Not Modified for the ones that did
+        not change.
+
+        returns: the file to send as the body, or None
+        '''
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urlparse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                return self._redirect(urlparse.urlunsplit(
+                    parts._replace(path=parts.path + '/')
+                ))
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            self.send_error(404, 'File not found')
+            return None
+
+        stat = os.fstat(fp.fileno())
+        etag = self.server.etags.get(path, stat)
+        encoding = None
+        if _accepts_gzip(self.headers.get('Accept-Encoding', '')):
+            copy = compressed_copy(self.server.routes.root, path)
+            if copy is not None:
+                fp.close()
+                fp = open(copy, 'rb')
+                etag, encoding = etag + '-gzip', 'gzip'
+        etag = '"%s"' % etag
+
+        if not self._modified(etag, stat.st_mtime):
+            fp.close()
+            self.send_response(304)
+            self._send_cache_headers(etag, stat.st_mtime)
+            self.end_headers()
+            return None
 
-        return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', os.fstat(fp.fileno()).st_size)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self._send_cache_headers(etag, stat.st_mtime)
+        self.end_headers()
+        return fp
+
+    def _redirect(self, location):
+        # The inherited redirect has no Content-Length, which leaves a
+        # keep-alive client waiting for a body
+        self.send_response(301)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return None
+
+    def _modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [x.strip() for x in if_none_match.split(',')]
+            tags = [x[2:] if x.startswith('W/') else x for x in tags]
+            return etag not in tags and '*' not in tags
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            return _modified_since(if_modified_since, mtime)
+        return True
+
+    def _send_cache_headers(self, etag, mtime):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
 
     def log_message(*args):
         return
 
 
-class TestServer(SocketServer.TCPServer):
-    '''A reusable test server
+class TestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''A reusable, multi-threaded test server
+
+    Each connection is handled in its own thread, so one slow client
+    does not hold up the others.
 
     Since this server may be stopped and restarted a lot
     we don't want to run into the "address already in use" error
     this resolves those problems
     '''
     allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, handler, routes, etags=None):
+        self.routes = routes
+        self.etags = etags or ETags()
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
 
 
 class WebServer(threading.Thread):
     def __init__(self, site_path, host=None, port=8880):
-        '''A single threaded SimpleHTTPServer
+        '''A multi-threaded SimpleHTTPServer
 
         This creates a daemon thread that sits and listens for web requests
         the thread stays alive untill the parent thread dies.
 
+        Call update(site) after each build so new pages are routed.
+
         By default we listen at localhost:8080
         '''
         if host is None:
@@ -58,17 +243,31 @@ class WebServer(threading.Thread):
             self.host = host
         self.port = port
         self.site_path = site_path
+        self.routes = Routes(site_path)
+        self.etags = ETags()
         threading.Thread.__init__(self)
         self.daemon = True
 
+    def start(self):
+        super(WebServer, self).start()
+        return self
+
+    def update(self, site):
+        self.routes.update(site)
+        self.etags.update(self.site_path)
+
     def run(self):
         '''Start the server
 
         Starts the server this function blocks this thread until
         the parent thread dies clossing this thread.
         '''
-        os.chdir(self.site_path)
-        self.server = TestServer(('', self.port), TestHandler)
+        self.server = TestServer(
+            ('', self.port),
+            TestHandler,
+            self.routes,
+            self.etags,
+        )
         logger.success(
             "Serving webpage at: {host}:{port}",
             host=self.host,
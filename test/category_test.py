@@ -1,5 +1,5 @@
 from doubles import InstanceDouble, allow
-from pytest import fixture
+from pytest import fixture, raises
 
 from staticpy.category import Category
 
@@ -143,3 +143,33 @@ class TestSubCategories(object):
         category_3.categories = []
 
         assert category.sub_categories == [category_2, category_3]
+
+
+class TestNeighbour(object):
+    def test_previous(self, category):
+        pages = dummy_pages(3)
+        allow(category).children.and_return(pages)
+        assert category.neighbour(pages[1], -1) is pages[0]
+        assert category.neighbour(pages[0], -1) is None
+
+    def test_next(self, category):
+        pages = dummy_pages(3)
+        allow(category).children.and_return(pages)
+        assert category.neighbour(pages[1], 1) is pages[2]
+        assert category.neighbour(pages[2], 1) is None
+
+    def test_not_a_child(self, category):
+        allow(category).children.and_return(dummy_pages(3))
+        assert category.neighbour(dummy_page(), 1) is None
+
+
+class TestGetAttr(object):
+    def test_finds_sub_category_by_slug(self, category):
+        category_2 = Category(category.site, 'pages/category/category_2')
+        category.categories = [category_2]
+        assert category.category_2 is category_2
+
+    def test_raises_attribute_error(self, category):
+        category.categories = []
+        with raises(AttributeError):
+            category.missing
@@ -0,0 +1,78 @@
+import os
+import gzip
+import time
+
+from pytest import fixture
+
+from staticpy.compression import Compressor, compressed_copy, compressed_path
+
+
+@fixture
+def output(tmpdir):
+    path = str(tmpdir.join('output'))
+    os.makedirs(os.path.join(path, 'blog'))
+    return path
+
+
+def write(path, contents):
+    with open(path, 'w') as fp:
+        fp.write(contents)
+
+
+def read_gzip(path):
+    with gzip.open(path) as fp:
+        return fp.read()
+
+
+class TestCompressor(object):
+    def test_compresses_large_files(self, output):
+        path = os.path.join(output, 'blog', 'post.html')
+        write(path, 'a' * 2000)
+        assert Compressor(output).compress() == 1
+        copy = compressed_path(output, path)
+        assert copy == os.path.join(output, '.gzip', 'blog', 'post.html.gz')
+        assert read_gzip(copy) == 'a' * 2000
+
+    def test_skips_small_and_incompressible_files(self, output):
+        write(os.path.join(output, 'small.html'), 'a')
+        write(os.path.join(output, 'image.png'), 'a' * 2000)
+        assert Compressor(output).compress() == 0
+
+    def test_skips_unchanged_files(self, output):
+        path = os.path.join(output, 'index.html')
+        write(path, 'a' * 2000)
+        Compressor(output).compress()
+        assert Compressor(output).compress() == 0
+
+        write(path, 'a' * 2000)
+        assert Compressor(output).compress() == 0
+        assert compressed_copy(output, path)
+
+        write(path, 'b' * 2000)
+        assert Compressor(output).compress() == 1
+        assert read_gzip(compressed_path(output, path)) == 'b' * 2000
+
+    def test_removes_copies_of_deleted_files(self, output):
+        path = os.path.join(output, 'index.html')
+        write(path, 'a' * 2000)
+        Compressor(output).compress()
+        os.remove(path)
+        Compressor(output).compress()
+        assert not os.path.exists(compressed_path(output, path))
+
+
+class TestCompressedCopy(object):
+    def test_missing_copy(self, output):
+        path = os.path.join(output, 'index.html')
+        write(path, 'a' * 2000)
+        assert compressed_copy(output, path) is None
+
+    def test_stale_copy(self, output):
+        path = os.path.join(output, 'index.html')
+        write(path, 'a' * 2000)
+        Compressor(output).compress()
+        assert compressed_copy(output, path) == compressed_path(output, path)
+
+        later = time.time() + 10
+        os.utime(path, (later, later))
+        assert compressed_copy(output, path) is None
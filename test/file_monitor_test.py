@@ -0,0 +1,163 @@
+import os
+import json
+import time
+
+from pytest import fixture
+
+from staticpy.file_monitor import FileUpdated
+
+
+class FakeEvent(object):
+    is_directory = False
+
+    def __init__(self, src_path, dest_path=None):
+        self.src_path = src_path
+        if dest_path:
+            self.dest_path = dest_path
+
+
+class FakePage(object):
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeSite(object):
+    def __init__(self, input_path):
+        self.input_path = input_path
+        self.pages = []
+        self.recompiled = []
+
+    def recompile(self, paths=None):
+        self.recompiled.append(paths)
+        return self.pages
+
+
+class FakeSocketServer(object):
+    def __init__(self):
+        self.messages = []
+
+    def broadcast(self, message, urls=None):
+        self.messages.append((json.loads(message), urls))
+
+
+@fixture
+def site(tmpdir):
+    path = str(tmpdir)
+    for directory in ['dynamic', 'static']:
+        os.makedirs(os.path.join(path, directory))
+    return FakeSite(path)
+
+
+def dynamic(site, name):
+    return os.path.join(site.input_path, 'dynamic', name)
+
+
+def static(site, name):
+    return os.path.join(site.input_path, 'static', name)
+
+
+def notify(site, pages=None, assets=()):
+    server = FakeSocketServer()
+    FileUpdated(server, site).notify(pages, assets)
+    return server.messages
+
+
+class TestNotify(object):
+    def test_reloads_affected_pages(self, site):
+        pages = [FakePage('/'), FakePage('/blog/post')]
+        assert notify(site, pages) == [
+            ({'reload': True}, ['/', '/blog/post']),
+        ]
+
+    def test_reloads_everything_after_a_full_rebuild(self, site):
+        assert notify(site, None) == [({'reload': True}, None)]
+
+    def test_nothing_rendered(self, site):
+        assert notify(site, []) == []
+
+    def test_swaps_stylesheets(self, site):
+        assets = [static(site, 'site.css'), static(site, 'css/print.css')]
+        assert notify(site, [], assets) == [
+            ({'css': ['/static/site.css', '/static/css/print.css']}, None),
+        ]
+
+    def test_reloads_for_other_assets(self, site):
+        assets = [static(site, 'site.css'), static(site, 'site.js')]
+        assert notify(site, [], assets) == [({'reload': True}, None)]
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestBatching(object):
+    def test_one_recompile_per_burst(self, site):
+        server = FakeSocketServer()
+        handler = FileUpdated(server, site, quiet_period=0.05)
+        for _ in range(50):
+            handler.dispatch(FakeEvent(dynamic(site, 'b.md')))
+            handler.dispatch(FakeEvent(dynamic(site, 'a.md')))
+        assert wait_for(lambda: site.recompiled)
+        time.sleep(0.1)
+        assert site.recompiled == [
+            [dynamic(site, 'a.md'), dynamic(site, 'b.md')],
+        ]
+
+    def test_waits_for_quiet(self, site):
+        handler = FileUpdated(None, site, quiet_period=0.2)
+        handler.dispatch(FakeEvent(dynamic(site, 'a.md')))
+        time.sleep(0.05)
+        assert site.recompiled == []
+        handler.stop()
+
+    def test_moves_include_both_paths(self, site):
+        handler = FileUpdated(None, site, quiet_period=10)
+        handler.dispatch(
+            FakeEvent(dynamic(site, 'a.md'), dynamic(site, 'b.md'))
+        )
+        handler.flush()
+        handler.stop()
+        assert site.recompiled == [
+            [dynamic(site, 'a.md'), dynamic(site, 'b.md')],
+        ]
+
+    def test_ignored_files(self, site):
+        server = FakeSocketServer()
+        handler = FileUpdated(server, site, quiet_period=10)
+        handler.dispatch(FakeEvent(dynamic(site, '.a.md.swp')))
+        handler.dispatch(FakeEvent(static(site, 'sitemap.xml')))
+        handler.dispatch(FakeEvent(
+            static(site, '.sitemap.xml.gz.a1_b2c'),
+            static(site, 'sitemap.xml.gz'),
+        ))
+        handler.flush()
+        handler.stop()
+        assert site.recompiled == []
+        assert server.messages == []
+
+    def test_assets_only(self, site):
+        server = FakeSocketServer()
+        handler = FileUpdated(server, site, quiet_period=10)
+        handler.dispatch(FakeEvent(static(site, 'site.css')))
+        handler.flush()
+        handler.stop()
+        assert site.recompiled == []
+        assert server.messages == [({'css': ['/static/site.css']}, None)]
+
+    def test_pages_and_stylesheets(self, site):
+        server = FakeSocketServer()
+        site.pages = [FakePage('/')]
+        handler = FileUpdated(server, site, quiet_period=10)
+        handler.dispatch(FakeEvent(static(site, 'site.css')))
+        handler.dispatch(FakeEvent(dynamic(site, 'index.md')))
+        handler.flush()
+        handler.stop()
+        assert site.recompiled == [[dynamic(site, 'index.md')]]
+        assert server.messages == [
+            ({'css': ['/static/site.css']}, None),
+            ({'reload': True}, ['/']),
+        ]
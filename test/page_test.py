@@ -1,26 +1,32 @@
+import os
+
 from doubles import allow, InstanceDouble, expect
 from pytest import fixture
 
 from staticpy.page import Page
-from staticpy.page.data import Data
+from staticpy.profiler import NullProfiler
+
+
+def new_page(tmpdir, url_path='url_path', contents=''):
+    path = tmpdir.join('file_path.page')
+    path.write(contents)
+    return Page(str(path), url_path, dummy_category())
 
 
 @fixture
-def page(request):
-    page = Page('file_path.page', 'url_path', dummy_category())
-    allow(page)._data.and_return(Data())
-    return page
+def page(tmpdir):
+    return new_page(tmpdir)
 
 
 def dummy_category():
     return InstanceDouble(
         'staticpy.category.Category',
-        site=InstanceDouble('staticpy.site.Site'),
+        site=InstanceDouble('staticpy.site.Site', profiler=NullProfiler()),
     )
 
 
-def test_converts_order_to_an_int(page):
-    allow(page)._data.and_return(Data(order='10'))
+def test_converts_order_to_an_int(tmpdir):
+    page = new_page(tmpdir, contents=':order: 10\n')
 
     assert page.order == 10
 
@@ -29,9 +35,8 @@ def test_order_defaults_to_infinity(page):
     assert page.order == float('inf')
 
 
-def test_path_is_correct_if_there_is_no_url_path():
-    page = Page('file_path', '', dummy_category())
-    allow(page)._data.and_return(Data())
+def test_path_is_correct_if_there_is_no_url_path(tmpdir):
+    page = new_page(tmpdir, url_path='')
 
     assert page.path == 'home'
 
@@ -40,9 +45,8 @@ def test_path_is_correct_if_there_is_a_url_path(page):
     assert page.path == 'url_path'
 
 
-def test_url_is_correct_for_index_page_with_no_url_path():
-    page = Page('file_path', '', dummy_category())
-    allow(page)._data.and_return(Data())
+def test_url_is_correct_for_index_page_with_no_url_path(tmpdir):
+    page = new_page(tmpdir, url_path='')
 
     assert page.url == '/file-path'
 
@@ -51,24 +55,17 @@ def test_url_is_correct_for_index_page_with_url_path(page):
     assert page.url == '/url_path/file-path'
 
 
-def test_url_is_correct_for_multi_element_url_path():
-    page = Page(
-        'file_path',
-        'url_path_1/url_path_2',
-        dummy_category()
-    )
-    allow(page)._data.and_return(Data())
+def test_url_is_correct_for_multi_element_url_path(tmpdir):
+    page = new_page(tmpdir, url_path='url_path_1/url_path_2')
 
     assert page.url == '/url_path_1/url_path_2/file-path'
 
 
-def test_reads_file_once_and_only_once():
-    page = Page('file_path', '', dummy_category())
+def test_reads_file_once_and_only_once(tmpdir):
+    page = new_page(tmpdir, contents=':foo: bar\n')
 
-    allow(page.reader).read.and_return(
-        Data(foo='bar'),
-    ).once()
     assert page.foo == 'bar'
+    os.remove(page.file_path)
     assert page.foo == 'bar'
 
 
@@ -79,3 +76,27 @@ def test_write_calls_write_page(page):
 
 def test_slug_replaces_underscores(page):
     assert page.slug == 'file-path'
+
+
+def test_missing_attributes_are_blank(page):
+    assert page.title == ''
+    assert not hasattr(page, '__html__')
+    assert not hasattr(page, '_doubles_target')
+
+
+def test_header_attributes_can_start_with_an_underscore(tmpdir):
+    page = new_page(tmpdir, contents=':_hidden: yes\n')
+    assert page._hidden == 'yes'
+
+
+def test_pages_have_no_instance_dict(page):
+    assert not hasattr(page, '__dict__')
+
+
+def test_prev_and_next_come_from_the_category(page):
+    before, after = Page('a', '', page.category), Page('b', '', page.category)
+    allow(page.category).neighbour.with_args(page, -1).and_return(before)
+    allow(page.category).neighbour.with_args(page, 1).and_return(after)
+
+    assert page.prev is before
+    assert page.next is after
@@ -0,0 +1,49 @@
+from staticpy.profiler import NullProfiler, Profiler
+
+
+def test_times_phases():
+    profiler = Profiler()
+    with profiler.phase('parse'):
+        pass
+    with profiler.phase('parse'):
+        pass
+    assert profiler.phases.keys() == ['parse']
+
+
+def test_nested_phases_are_not_counted_twice():
+    profiler = Profiler()
+    with profiler.phase('render'):
+        with profiler.phase('parse'):
+            for _ in range(100000):
+                pass
+    assert profiler.phases['render'] < profiler.phases['parse']
+
+
+def test_templates_are_timed_as_render():
+    profiler = Profiler()
+    assert list(profiler.render('base.html', ['a', 'b'])) == ['a', 'b']
+    assert list(profiler.render('base.html', [])) == []
+    assert profiler.renders['base.html'] == 2
+    assert 'base.html' in profiler.templates
+    assert 'render' in profiler.phases
+
+
+def test_merge():
+    profiler, other = Profiler(), Profiler()
+    other.phases['parse'] = 1.0
+    other.templates['base.html'] = 2.0
+    other.renders['base.html'] = 3
+    profiler.phases['parse'] = 1.0
+
+    profiler.merge(other)
+    assert profiler.phases['parse'] == 2.0
+    assert profiler.templates['base.html'] == 2.0
+    assert profiler.renders['base.html'] == 3
+
+
+def test_null_profiler():
+    profiler = NullProfiler()
+    with profiler.phase('parse'):
+        pass
+    assert list(profiler.render('base.html', ['a', 'b'])) == ['a', 'b']
+    profiler.merge(Profiler())
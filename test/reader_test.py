@@ -0,0 +1,135 @@
+from StringIO import StringIO
+
+from pytest import fixture
+
+from staticpy.page.data import LazyValue
+from staticpy.page.reader import Reader, _attributes
+from staticpy.profiler import Profiler
+
+
+@fixture
+def read(tmpdir):
+    def read(contents, **kwargs):
+        path = tmpdir.join('page.page')
+        path.write(contents)
+        reader = Reader()
+        for name, value in kwargs.items():
+            setattr(reader, name, value)
+        return reader.read(str(path))
+    return read
+
+
+def test_single_line_attributes(read):
+    data = read(':title: A Title\n:published: 1\n')
+    assert data.title == 'A Title'
+    assert data.published == '1'
+
+
+def test_multi_line_attributes(read):
+    data = read(':content:\n  line one\n  line two\n\n:title: t\n')
+    assert data.content == 'line one\n  line two'
+
+
+def test_value_continues_on_the_next_lines(read):
+    data = read(':title: first\nsecond\n')
+    assert data.title == 'firstsecond'
+
+
+def test_dashes_become_underscores(read):
+    data = read(':meta-description: words\n')
+    assert data.meta_description == 'words'
+
+
+def test_list_attributes(read):
+    data = read(':css-imports[list]:\n  a.css\n  b.css\n')
+    assert data.css_imports == ['a.css', 'b.css']
+
+
+def test_int_attributes(read):
+    data = read(':count[int]: 10\n')
+    assert data.count == 10
+
+
+def test_empty_attributes_are_skipped(read):
+    data = read(':title:\n:content: body\n')
+    assert data.get('title') is None
+    assert data.content == 'body'
+
+
+def test_text_without_attributes(read):
+    data = read('just text\n')
+    assert data.get('') == 'just text'
+
+
+def test_large_values_are_loaded_lazily(read):
+    body = ''.join('line %s\n' % i for i in range(100))
+    data = read(':title: t\n:content:\n' + body + ':order: 1\n', lazy_size=64)
+
+    assert isinstance(data._data['content'], LazyValue)
+    assert not isinstance(data._data['title'], LazyValue)
+    assert data.content == body.strip()
+    assert data.order == '1'
+
+
+def test_large_list_values_are_cast_when_loaded(read):
+    items = ['item-%s' % i for i in range(50)]
+    data = read(':items[list]:\n' + '\n'.join(items) + '\n', lazy_size=64)
+    assert data.items == items
+
+
+def test_values_at_the_lazy_size_are_read_straight_away(read):
+    body = 'x' * 63 + '\n'
+    data = read(':content:\n' + body + ':title: t', lazy_size=64)
+    assert not isinstance(data._data['content'], LazyValue)
+    assert data.content == 'x' * 63
+    assert data.title == 't'
+
+
+def test_large_value_at_the_end_of_the_file(read):
+    body = 'x' * 100
+    data = read(':title: t\n:content:\n' + body, lazy_size=64)
+    assert isinstance(data._data['content'], LazyValue)
+    assert data.content == body
+
+
+def test_large_values_are_loaded_once(read, monkeypatch):
+    body = 'x' * 100
+    data = read(':content:\n' + body, lazy_size=64)
+    assert data.content == body
+
+    def read_range(*args):
+        raise AssertionError('read again')
+
+    monkeypatch.setattr('staticpy.page.reader._read_range', read_range)
+    assert data.content == body
+
+
+def test_large_values_of_changed_files_are_read_again(read, tmpdir):
+    data = read(':title: t\n:content:\n' + 'x' * 100, lazy_size=64)
+    tmpdir.join('page.page').write(':content:\n' + 'y' * 200)
+    assert data.content == 'y' * 200
+
+
+def test_large_values_are_loaded_in_the_parse_phase(tmpdir):
+    path = tmpdir.join('page.page')
+    path.write(':content:\n' + 'x' * 2000)
+    profiler = Profiler()
+    data = Reader().read(str(path), profiler)
+    assert profiler.phases == {}
+    with profiler.phase('render'):
+        assert data.content == 'x' * 2000
+    assert 'parse' in profiler.phases
+
+
+def test_headers_split_across_chunks_are_found():
+    contents = (
+        'intro\n:title: A Title\n:content:\n  body :not: a header\n'
+        + 'x' * 80 + '\n:tags[list]:\n  a\n  b\n:long: ' + 'y' * 100
+    )
+    expected = list(_attributes(StringIO(contents), 64))
+    assert [a[0] for a in expected] == [
+        '', 'title', 'content', 'tags', 'long',
+    ]
+    for chunk_size in range(1, len(contents) + 1):
+        attributes = _attributes(StringIO(contents), 64, chunk_size)
+        assert list(attributes) == expected
@@ -0,0 +1,452 @@
+import os
+import time
+import hashlib
+import threading
+
+from pytest import fixture
+
+from staticpy.compression import Compressor
+from staticpy.s3_uploader import (
+    Scheduler,
+    Uploader,
+    file_filter,
+    get_key,
+    multipart_etag,
+    part_digests,
+)
+
+
+class FakeKey(object):
+    def __init__(self, bucket, name, etag=None):
+        self.bucket = bucket
+        self.name = name
+        self.etag = etag
+
+    def set_contents_from_file(self, fp, headers=None, md5=None):
+        contents = fp.read()
+        self.etag = '"%s"' % hashlib.md5(contents).hexdigest()
+        assert md5 is None or md5[0] == self.etag.strip('"')
+        self.bucket.objects[self.name] = (contents, headers, self.etag)
+        self.bucket.uploads.append(self.name)
+
+
+class FakeMultiPartUpload(object):
+    '''Like boto's MultiPartUpload it can be made for any bucket from its
+    key_name and id, and like a boto connection it is only used from the
+    thread that made it.
+    '''
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+        self.key_name = None
+        self.id = None
+        self.headers = None
+        self.parts = {}
+        self.cancelled = False
+        self.thread = threading.current_thread().ident
+
+    def upload_part_from_file(self, fp, part_num, md5=None, size=None):
+        assert threading.current_thread().ident == self.thread
+        contents = fp.read(size)
+        assert md5[0] == hashlib.md5(contents).hexdigest()
+        self.bucket.multipart_uploads[self.id].parts[part_num] = contents
+
+    def complete_upload(self):
+        assert threading.current_thread().ident == self.thread
+        name = self.key_name
+        parts = [self.parts[n] for n in sorted(self.parts)]
+        md5 = hashlib.md5(''.join(hashlib.md5(p).digest() for p in parts))
+        etag = '"%s-%s"' % (md5.hexdigest(), len(parts))
+        self.bucket.objects[name] = (''.join(parts), self.headers, etag)
+        self.bucket.uploads.append(name)
+        return FakeKey(self.bucket, name, etag)
+
+    def cancel_upload(self):
+        self.cancelled = True
+
+
+class FakeBucket(object):
+    '''An in memory stand-in for a boto Bucket'''
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+        self.deletes = []
+        self.multipart_uploads = []
+        self.lists = 0
+
+    def list(self):
+        self.lists += 1
+        return [
+            FakeKey(self, name, etag)
+            for name, (_, _, etag) in self.objects.items()
+        ]
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def initiate_multipart_upload(self, name, headers=None):
+        upload = FakeMultiPartUpload(self)
+        upload.key_name = name
+        upload.id = len(self.multipart_uploads)
+        upload.headers = headers
+        self.multipart_uploads.append(upload)
+        return upload
+
+    def delete_keys(self, keys):
+        self.deletes.append(list(keys))
+        for key in keys:
+            del self.objects[key]
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.buckets = {'bucket': FakeBucket()}
+        self.connections = []
+
+    def connect(self):
+        self.connections.append(threading.current_thread().ident)
+        return self
+
+    def get_bucket(self, name, validate=True):
+        return self.buckets[name]
+
+
+@fixture
+def s3():
+    return FakeS3()
+
+
+@fixture
+def source(tmpdir):
+    path = str(tmpdir.join('output'))
+    os.makedirs(os.path.join(path, 'blog'))
+    write(os.path.join(path, 'index.html'), 'home')
+    write(os.path.join(path, 'blog', 'post.html'), 'post')
+    write(os.path.join(path, '.manifest.json'), '{}')
+    return path
+
+
+def write(path, contents):
+    with open(path, 'w') as fp:
+        fp.write(contents)
+
+
+def uploader(s3, source, **kwargs):
+    kwargs.setdefault('threads', 2)
+    return Uploader(s3.connect, 'bucket', source, backoff=0, **kwargs)
+
+
+class TestKeys(object):
+    def test_get_key(self):
+        assert get_key('/out', '/out/blog/post.html') == 'blog/post'
+        assert get_key('/out', '/out/index.html') == 'index.html'
+        assert get_key('/out', '/out/static/a.css') == 'static/a.css'
+
+    def test_file_filter(self):
+        assert file_filter('blog/post.html')
+        assert not file_filter('.manifest.json')
+        assert not file_filter(os.path.join('.gzip', 'index.html.gz'))
+
+
+class TestUploader(object):
+    def test_uploads_every_file(self, s3, source):
+        uploaded, deleted = uploader(s3, source).sync()
+        bucket = s3.buckets['bucket']
+        assert sorted(uploaded) == ['blog/post', 'index.html']
+        assert bucket.objects['blog/post'][0] == 'post'
+        assert deleted == []
+
+    def test_lists_bucket_once(self, s3, source):
+        uploader(s3, source).sync()
+        assert s3.buckets['bucket'].lists == 1
+
+    def test_skips_unchanged_files(self, s3, source):
+        uploader(s3, source).sync()
+        write(os.path.join(source, 'index.html'), 'new home')
+        uploaded, _ = uploader(s3, source).sync()
+        assert uploaded == ['index.html']
+
+    def test_deletes_removed_files_in_batches(self, s3, source, monkeypatch):
+        monkeypatch.setattr('staticpy.s3_uploader.DELETE_BATCH_SIZE', 2)
+        bucket = s3.buckets['bucket']
+        for name in 'abc':
+            bucket.objects[name] = ('', None, '"etag"')
+        _, deleted = uploader(s3, source).sync()
+        assert deleted == ['a', 'b', 'c']
+        assert bucket.deletes == [['a', 'b'], ['c']]
+        assert sorted(bucket.objects) == ['blog/post', 'index.html']
+
+    def test_reuses_a_connection_per_thread(self, s3, source):
+        for n in range(20):
+            write(os.path.join(source, '%s.txt' % n), str(n))
+        uploader(s3, source).sync()
+        # the main thread lists the bucket, two threads upload both the
+        # static files and the pages
+        assert len(s3.connections) <= 3
+
+    def test_uploads_compressed_copies(self, s3, source):
+        write(os.path.join(source, 'index.html'), 'home' * 1000)
+        Compressor(source).compress()
+        uploader(s3, source).sync()
+        contents, headers, _ = s3.buckets['bucket'].objects['index.html']
+        assert contents.startswith('\x1f\x8b')
+        assert headers == {
+            'Content-Type': 'text/html',
+            'Content-Encoding': 'gzip',
+        }
+
+
+class TestUploadManifest(object):
+    def _count_hashes(self, monkeypatch):
+        hashed = []
+
+        def file_hash(path):
+            hashed.append(path)
+            with open(path, 'rb') as fp:
+                return hashlib.md5(fp.read()).hexdigest()
+
+        monkeypatch.setattr('staticpy.s3_uploader.file_hash', file_hash)
+        return hashed
+
+    def test_unchanged_files_are_not_hashed(self, s3, source, monkeypatch):
+        uploader(s3, source).sync()
+        hashed = self._count_hashes(monkeypatch)
+        path = os.path.join(source, 'index.html')
+        write(path, 'new home')
+        uploaded, _ = uploader(s3, source).sync()
+        assert uploaded == ['index.html']
+        assert hashed == [path]
+
+    def test_is_not_uploaded(self, s3, source):
+        uploader(s3, source).sync()
+        assert not any(
+            name.startswith('.') for name in s3.buckets['bucket'].objects
+        )
+        assert os.path.isfile(os.path.join(source, '.upload-bucket.json'))
+
+    def test_changed_remote_files_are_uploaded(self, s3, source):
+        uploader(s3, source).sync()
+        s3.buckets['bucket'].objects['index.html'] = ('', None, '"other"')
+        uploaded, _ = uploader(s3, source).sync()
+        assert uploaded == ['index.html']
+
+    def test_interrupted_upload_resumes(self, s3, source, monkeypatch):
+        for n in range(10):
+            write(os.path.join(source, '%s.txt' % n), str(n))
+        monkeypatch.setattr(
+            'staticpy.s3_uploader.UploadManifest.save_every',
+            1,
+        )
+        set_contents = FakeKey.set_contents_from_file
+
+        def fail(key, fp, **kwargs):
+            if key.name == '5.txt':
+                raise IOError('connection reset')
+            set_contents(key, fp, **kwargs)
+
+        monkeypatch.setattr(FakeKey, 'set_contents_from_file', fail)
+        failed = uploader(s3, source, threads=1)
+        failed.sync()
+        assert [f[0][0] for f in failed.failures] == ['5.txt']
+
+        monkeypatch.setattr(FakeKey, 'set_contents_from_file', set_contents)
+        hashed = self._count_hashes(monkeypatch)
+        uploaded, _ = uploader(s3, source).sync()
+        assert '5.txt' in uploaded
+        assert len(hashed) == len(uploaded) < 12
+
+
+class TestMultipart(object):
+    @fixture(autouse=True)
+    def small_parts(self, monkeypatch):
+        monkeypatch.setattr('staticpy.s3_uploader.PART_SIZE', 10)
+        monkeypatch.setattr('staticpy.s3_uploader.MAX_PARTS', 3)
+
+    def _uploader(self, s3, source):
+        return uploader(s3, source, multipart_threshold=20)
+
+    def test_part_digests(self, source):
+        path = os.path.join(source, 'video.mp4')
+        write(path, 'a' * 25)
+        assert part_digests(path, 25) == [
+            hashlib.md5('a' * 10).hexdigest(),
+            hashlib.md5('a' * 10).hexdigest(),
+            hashlib.md5('a' * 5).hexdigest(),
+        ]
+
+    def test_parts_grow_to_fit_max_parts(self, source):
+        path = os.path.join(source, 'video.mp4')
+        write(path, 'a' * 35)
+        assert len(part_digests(path, 35)) == 3
+
+    def test_multipart_etag(self):
+        digests = [hashlib.md5('a').hexdigest(), hashlib.md5('b').hexdigest()]
+        md5 = hashlib.md5(
+            hashlib.md5('a').digest() + hashlib.md5('b').digest()
+        )
+        assert multipart_etag(digests) == md5.hexdigest() + '-2'
+
+    def test_large_files_are_uploaded_in_parts(self, s3, source):
+        write(os.path.join(source, 'video.mp4'), 'abcdefghij' * 3)
+        uploaded, _ = self._uploader(s3, source).sync()
+        bucket = s3.buckets['bucket']
+        assert 'video.mp4' in uploaded
+        assert [u.key_name for u in bucket.multipart_uploads] == [
+            'video.mp4',
+        ]
+        assert len(bucket.multipart_uploads[0].parts) == 3
+        contents, headers, _ = bucket.objects['video.mp4']
+        assert contents == 'abcdefghij' * 3
+        assert headers == {'Content-Type': 'video/mp4'}
+
+    def test_unchanged_multipart_files_are_skipped(self, s3, source):
+        path = os.path.join(source, 'video.mp4')
+        write(path, 'abcdefghij' * 3)
+        self._uploader(s3, source).sync()
+        os.remove(os.path.join(source, '.upload-bucket.json'))
+        uploaded, _ = self._uploader(s3, source).sync()
+        assert uploaded == []
+
+    def test_failed_parts_cancel_the_upload(self, s3, source, monkeypatch):
+        write(os.path.join(source, 'video.mp4'), 'abcdefghij' * 3)
+
+        def fail(upload, fp, part_num, **kwargs):
+            raise IOError('connection reset')
+
+        monkeypatch.setattr(FakeMultiPartUpload, 'upload_part_from_file', fail)
+        failed = self._uploader(s3, source)
+        failed.sync()
+        assert len(failed.failures) == 1
+        assert s3.buckets['bucket'].multipart_uploads[0].cancelled
+
+    def test_failed_parts_are_retried(self, s3, source, monkeypatch):
+        write(os.path.join(source, 'video.mp4'), 'abcdefghij' * 3)
+        upload_part = FakeMultiPartUpload.upload_part_from_file
+        failed = []
+
+        def fail_once(upload, fp, part_num, **kwargs):
+            if part_num not in failed:
+                failed.append(part_num)
+                raise IOError('connection reset')
+            return upload_part(upload, fp, part_num, **kwargs)
+
+        monkeypatch.setattr(
+            FakeMultiPartUpload,
+            'upload_part_from_file',
+            fail_once,
+        )
+        uploaded, _ = self._uploader(s3, source).sync()
+        bucket = s3.buckets['bucket']
+        assert 'video.mp4' in uploaded
+        assert len(bucket.multipart_uploads) == 1
+        assert not bucket.multipart_uploads[0].cancelled
+        assert bucket.objects['video.mp4'][0] == 'abcdefghij' * 3
+
+
+@fixture
+def scheduler(request):
+    '''Make Schedulers that are closed at the end of the test'''
+    schedulers = []
+
+    def make(*args, **kwargs):
+        schedulers.append(Scheduler(*args, **kwargs))
+        return schedulers[-1]
+
+    def close():
+        for scheduler in schedulers:
+            scheduler.close()
+
+    request.addfinalizer(close)
+    return make
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestScheduler(object):
+    def test_runs_every_item(self, scheduler):
+        scheduler = scheduler(lambda x: x * 2, threads=3).run(range(20))
+        assert sorted(scheduler.results) == [(x, x * 2) for x in range(20)]
+        assert scheduler.failures == []
+
+    def test_retries_failures(self, scheduler):
+        calls = []
+
+        def work(item):
+            calls.append(item)
+            if len(calls) < 3:
+                raise IOError('timeout')
+            return item
+
+        scheduler = scheduler(work, threads=1, backoff=0).run(['a'])
+        assert scheduler.results == [('a', 'a')]
+        assert calls == ['a', 'a', 'a']
+
+    def test_keeps_failures(self, scheduler):
+        def work(item):
+            raise IOError(item)
+
+        scheduler = scheduler(work, threads=2, retries=1, backoff=0)
+        scheduler.run(['a', 'b'])
+        assert scheduler.results == []
+        assert sorted(str(e) for _, e in scheduler.failures) == ['a', 'b']
+
+    def test_queue_is_bounded(self, scheduler):
+        produced = []
+        fourth = threading.Event()
+        done = threading.Event()
+
+        def items():
+            for n in range(10):
+                produced.append(n)
+                if len(produced) == 4:
+                    fourth.set()
+                yield n
+
+        def work(item):
+            done.wait()
+
+        scheduler = scheduler(work, threads=1, queue_size=2)
+        thread = threading.Thread(target=scheduler.run, args=(items(),))
+        thread.start()
+        try:
+            assert fourth.wait(5)
+            assert wait_for(scheduler._queue.full)
+            # one item being worked on, two queued and one waiting to be put
+            assert len(produced) == 4
+        finally:
+            done.set()
+            thread.join()
+        assert len(scheduler.results) == 10
+
+
+class TestOrdering(object):
+    def test_uploads_assets_before_pages(self, s3, source):
+        os.makedirs(os.path.join(source, 'static'))
+        write(os.path.join(source, 'static', 'site.css'), 'css')
+        uploader(s3, source, threads=1).sync()
+        uploads = s3.buckets['bucket'].uploads
+        assert uploads.index('static/site.css') < uploads.index('index.html')
+        assert uploads.index('static/site.css') < uploads.index('blog/post')
+
+    def test_failed_assets_stop_pages_and_deletes(self, s3, source,
+                                                  monkeypatch):
+        os.makedirs(os.path.join(source, 'static'))
+        write(os.path.join(source, 'static', 'site.css'), 'css')
+        bucket = s3.buckets['bucket']
+        bucket.objects['old'] = ('', None, '"etag"')
+        set_contents = FakeKey.set_contents_from_file
+
+        def fail(key, fp, **kwargs):
+            if key.name.startswith('static'):
+                raise IOError('connection reset')
+            set_contents(key, fp, **kwargs)
+
+        monkeypatch.setattr(FakeKey, 'set_contents_from_file', fail)
+        uploaded, deleted = uploader(s3, source).sync()
+        assert uploaded == deleted == []
+        assert sorted(bucket.objects) == ['old']
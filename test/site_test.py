@@ -1,9 +1,13 @@
 import os
+import shutil
 
-from pytest import fixture
+from pytest import fixture, raises
 from doubles import expect, allow
 
 import staticpy.site
+from staticpy.page.reader import Reader
+from staticpy.page.writer import Writer
+from staticpy.site.manifest import Manifest
 from staticpy.utils import load_settings
 
 
@@ -16,10 +20,52 @@ def get_settings():
     return load_settings('/' + path)
 
 
+def copy_site(tmpdir):
+    path = str(tmpdir.join('site'))
+    shutil.copytree(
+        get_settings().input_path,
+        path,
+        ignore=shutil.ignore_patterns('.output'),
+    )
+    return path
+
+
+def new_site(path):
+    site = staticpy.site.Site(load_settings(path))
+    if not os.path.isdir(site.output_path):
+        os.mkdir(site.output_path)
+    allow(site.sitemap).write
+    return site
+
+
+@fixture
+def rendered(monkeypatch):
+    '''The pages rendered by the shared page Writer during a test'''
+    pages = []
+    write = Writer.write
+
+    def record(self, page):
+        pages.append(page)
+        return write(self, page)
+
+    monkeypatch.setattr(Writer, 'write', record)
+    return pages
+
+
 @fixture
 def site(request):
     site = staticpy.site.Site(get_settings())
     allow(site.sitemap).write
+
+    # Saves record a manifest in the shared output directory, without it
+    # every test starts from a full build
+    def forget_build():
+        manifest = Manifest(site.output_path)
+        if os.path.isfile(manifest.path):
+            os.remove(manifest.path)
+
+    forget_build()
+    request.addfinalizer(forget_build)
     return site
 
 
@@ -38,13 +84,240 @@ class TestInit(object):
 
 
 class TestSave(object):
-    def test_calls_write_on_each_page(self, site):
-        for page in site.pages:
-            expect(page).write
+    def test_renders_each_page(self, site, rendered):
         site.save()
+        assert set(rendered) == set(p for p in site.pages if not p.no_render)
 
     def test_renders_sitemap(self, site):
-        for page in site.pages:
-            allow(page).write
         expect(site.sitemap).write
         site.save()
+
+
+class TestTemplateEnv(object):
+    def test_is_shared(self, site):
+        assert site.template_env is site.template_env
+
+    def test_survives_bust_cache(self, site):
+        env = site.template_env
+        site.bust_cache()
+        assert site.template_env is env
+
+    def test_no_bytecode_cache_by_default(self, site):
+        assert site.template_env.bytecode_cache is None
+
+    def test_bytecode_cache(self, tmpdir):
+        settings = get_settings()
+        settings.template_cache_path = str(tmpdir.join('cache'))
+        site = staticpy.site.Site(settings)
+        assert site.template_env.bytecode_cache is not None
+        assert tmpdir.join('cache').check(dir=True)
+
+
+class TestRecompile(object):
+    def _page(self, site, name):
+        for page in site.pages:
+            if page.file_path.endswith(name):
+                return page
+
+    def test_rebuilds_everything_without_paths(self, site):
+        expect(site).bust_cache.once()
+        expect(site).save.once()
+        assert site.recompile() is None
+
+    def test_rebuilds_everything_for_unknown_paths(self, site):
+        expect(site).save.once()
+        assert site.recompile(['dynamic/templates/base.html']) is None
+
+    def test_rebuilds_everything_for_index_pages(self, site):
+        index = self._page(site, 'index.page')
+        expect(site).save.once()
+        assert site.recompile([index.file_path]) is None
+
+    def test_only_rewrites_dependent_pages(self, site, rendered):
+        page = self._page(site, 'page.page')
+        index = page.category.index
+        expect(site.sitemap).write.once()
+
+        assert site.recompile([page.file_path]) == [page, index]
+        assert rendered == [page, index]
+
+    def test_rewrites_pages_that_looked_the_page_up(self, site, rendered):
+        page = self._page(site, 'page.page')
+        home = site.base.index
+        with site.rendering(home):
+            site.page_at('category/page')
+
+        pages = [page, page.category.index, home]
+        assert site.recompile([page.file_path]) == pages
+        assert rendered == pages
+
+
+class TestParallelSave(object):
+    def _build(self, path, jobs):
+        site = new_site(path)
+        site.save(jobs)
+
+        output = {}
+        for directory, _, files in os.walk(site.output_path):
+            for name in files:
+                file_path = os.path.join(directory, name)
+                with open(file_path) as fp:
+                    output[file_path] = fp.read()
+        shutil.rmtree(site.output_path)
+        return output
+
+    def test_output_matches_serial_build(self, tmpdir):
+        path = copy_site(tmpdir)
+        serial = self._build(path, 1)
+        assert serial
+        assert self._build(path, 2) == serial
+
+    def test_counts_written_and_skipped_files(self, tmpdir):
+        site = new_site(copy_site(tmpdir))
+        first = site.save(2)
+        assert first['written'] == len(site.pages)
+        assert not first['skipped']
+        assert site.save() == {'skipped': len(site.pages)}
+
+    def test_workers_use_the_parsed_pages(self, tmpdir, monkeypatch):
+        site = new_site(copy_site(tmpdir))
+        assert all(p.template_name for p in site.pages)
+
+        def read(self, path):
+            raise AssertionError('%s was read again' % path)
+
+        monkeypatch.setattr(Reader, 'read', read)
+        assert site.save(2)['written'] == len(site.pages)
+
+
+class TestIncrementalSave(object):
+    def _page(self, site, name):
+        for page in site.pages:
+            if page.file_path.endswith(name):
+                return page
+
+    def test_rerenders_changed_page_and_its_index(self, tmpdir, rendered):
+        path = copy_site(tmpdir)
+        new_site(path).save()
+
+        site = new_site(path)
+        page = self._page(site, 'page.page')
+        with open(page.file_path, 'a') as fp:
+            fp.write('more content\n')
+
+        del rendered[:]
+        site.save()
+        assert set(rendered) == set([page, page.category.index])
+
+    def test_skips_unchanged_site(self, tmpdir, rendered):
+        path = copy_site(tmpdir)
+        new_site(path).save()
+
+        site = new_site(path)
+        del rendered[:]
+        assert site.save() == {'skipped': len(site.pages)}
+        assert rendered == []
+
+    def test_scoped_recompile_records_the_build(self, tmpdir, rendered):
+        path = copy_site(tmpdir)
+        site = new_site(path)
+        site.save()
+        page = self._page(site, 'page.page')
+        with open(page.file_path, 'a') as fp:
+            fp.write('more content\n')
+        assert site.recompile([page.file_path]) == [page, page.category.index]
+
+        del rendered[:]
+        new_site(path).save()
+        assert rendered == []
+
+    def test_rerenders_pages_that_looked_up_a_changed_page(
+        self, tmpdir, rendered
+    ):
+        path = copy_site(tmpdir)
+        site = new_site(path)
+        site.save()
+        # As if the home page's template used page_at('category/page')
+        site.lookups[site.base.index.url] = set([
+            self._page(site, 'page.page').file_path,
+        ])
+        site.save()
+
+        site = new_site(path)
+        page = self._page(site, 'page.page')
+        with open(page.file_path, 'a') as fp:
+            fp.write('more content\n')
+
+        del rendered[:]
+        site.save()
+        assert set(rendered) == set([
+            page,
+            page.category.index,
+            site.base.index,
+        ])
+
+    def test_removes_output_of_deleted_pages(self, tmpdir):
+        path = copy_site(tmpdir)
+        site = new_site(path)
+        site.save()
+        page = self._page(site, 'page.page')
+        assert os.path.isfile(page.output_path)
+
+        os.remove(page.file_path)
+        new_site(path).save()
+        assert not os.path.isfile(page.output_path)
+
+    def test_rerenders_everything_when_a_template_changes(
+        self, tmpdir, rendered
+    ):
+        path = copy_site(tmpdir)
+        new_site(path).save()
+        template = os.path.join(path, 'dynamic', 'templates', 'base.html')
+        with open(template, 'a') as fp:
+            fp.write('<!-- changed -->')
+
+        site = new_site(path)
+        del rendered[:]
+        site.save()
+        assert set(rendered) == set(
+            p for p in site.pages if not p.no_render
+        )
+
+
+class TestPageLookup(object):
+    def test_page_at(self, site):
+        page = site.base.category.children[0]
+        assert site.page_at('category/page') is page
+        assert site.page_at('/category/page/') is page
+
+    def test_page_at_root(self, site):
+        assert site.page_at('/') is site.base.index
+
+    def test_page_at_missing_page(self, site):
+        assert site.page_at('missing') is None
+
+    def test_url_for(self, site):
+        assert site.url_for('category') == '/category'
+
+    def test_url_for_missing_page(self, site):
+        with raises(ValueError):
+            site.url_for('missing')
+
+    def test_templates_can_use_helpers(self, site):
+        template = site.template_env.from_string("{{ url_for('category') }}")
+        assert template.render() == '/category'
+
+    def test_records_lookups_while_rendering(self, site):
+        template = site.template_env.from_string(
+            "{{ url_for('category/page') }}"
+        )
+        home = site.base.index
+        with site.rendering(home):
+            template.render()
+        assert site.lookups == {
+            home.url: set([site.page_at('category/page').file_path]),
+        }
+
+    def test_lookups_outside_rendering_are_not_recorded(self, site):
+        site.page_at('category/page')
+        assert site.lookups == {}
@@ -0,0 +1,117 @@
+import os
+import gzip
+import shutil
+
+from jinja2 import DictLoader, Environment
+from pytest import fixture
+
+import staticpy.site
+from staticpy.utils import load_settings
+
+
+@fixture
+def site(tmpdir):
+    path = str(tmpdir.join('site'))
+    template = os.path.join(os.path.dirname(__file__), '..', 'template')
+    shutil.copytree(
+        template,
+        path,
+        ignore=shutil.ignore_patterns('.output'),
+    )
+    site = staticpy.site.Site(load_settings(path))
+    os.mkdir(site.output_path)
+    os.mkdir(os.path.join(site.output_path, 'static'))
+    return site
+
+
+def read(path):
+    with open(path) as fp:
+        return fp.read()
+
+
+def read_gzip(path):
+    with gzip.open(path) as fp:
+        return fp.read()
+
+
+class TestSitemap(object):
+    def test_lists_sitemap_pages(self, site):
+        site.sitemap.write()
+        contents = read(site.sitemap.path)
+        assert contents.startswith('<?xml')
+        assert contents.count('<url>') == len(site.sitemap_links)
+        for page in site.sitemap_links:
+            assert '<loc>%s</loc>' % (site.base_url + page.url) in contents
+
+    def test_writes_gzipped_copy(self, site):
+        site.sitemap.write()
+        path = site.sitemap.path
+        assert read_gzip(path + '.gz') == read(path)
+
+    def test_unchanged_sitemap_is_not_rewritten(self, site):
+        assert site.sitemap.write()
+        assert not site.sitemap.write()
+
+    def test_records_paths_written(self, site):
+        site.sitemap.write()
+        path = site.sitemap.path
+        assert site.sitemap.paths == [path, path + '.gz']
+
+    def test_splits_into_sitemap_index(self, site):
+        site.sitemap.max_urls = 1
+        site.sitemap.write()
+
+        count = len(site.sitemap_links)
+        index = read(site.sitemap.path)
+        assert '<sitemapindex' in index
+        assert index.count('<sitemap>') == count
+        assert len(site.sitemap.paths) == 2 * (count + 1)
+        for number in range(1, count + 1):
+            part = site.sitemap._part_path(number)
+            assert part + '.gz' in site.sitemap.paths
+            assert read(part).count('<url>') == 1
+            assert read_gzip(part + '.gz') == read(part)
+
+    def test_splits_on_size(self, site):
+        site.sitemap.max_size = 1
+        site.sitemap.write()
+        index = read(site.sitemap.path)
+        assert index.count('<sitemap>') == len(site.sitemap_links)
+
+    def test_unchanged_split_sitemap_is_not_rewritten(self, site):
+        site.sitemap.max_urls = 1
+        assert site.sitemap.write()
+        mtimes = dict((x, os.path.getmtime(x)) for x in site.sitemap.paths)
+        assert not site.sitemap.write()
+        assert mtimes == dict(
+            (x, os.path.getmtime(x)) for x in site.sitemap.paths
+        )
+
+
+class TestSitemapTemplate(object):
+    TEMPLATE = (
+        '<urlset>{% for page in pages %}'
+        '<url>{{ base_url }}{{ page.url }}</url>'
+        '{% endfor %}</urlset>'
+    )
+
+    @fixture
+    def site(self, site):
+        site._template_env = Environment(
+            loader=DictLoader({'sitemap.html': self.TEMPLATE}),
+        )
+        return site
+
+    def test_renders_the_sites_template(self, site):
+        site.sitemap.write()
+        contents = read(site.sitemap.path)
+        assert contents.count('<url>') == len(site.sitemap_links)
+        for page in site.sitemap_links:
+            assert '<url>%s</url>' % (site.base_url + page.url) in contents
+
+    def test_splits_into_sitemap_index(self, site):
+        site.sitemap.max_urls = 1
+        site.sitemap.write()
+        index = read(site.sitemap.path)
+        assert index.count('<sitemap>') == len(site.sitemap_links)
+        assert read(site.sitemap._part_path(1)).count('<url>') == 1
@@ -0,0 +1,189 @@
+import os
+import time
+import socket
+from struct import pack
+
+from pytest import fixture
+
+from staticpy.socket_server import (
+    OPCODE_CLOSE,
+    OPCODE_PING,
+    OPCODE_PONG,
+    OPCODE_TEXT,
+    SocketServer,
+    frame,
+    page_url,
+    read_frame,
+)
+
+HANDSHAKE = '\r\n'.join([
+    'GET / HTTP/1.1',
+    'Upgrade: websocket',
+    'Connection: Upgrade',
+    'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==',
+    'Sec-WebSocket-Version: 13',
+]) + '\r\n\r\n'
+
+
+def client_frame(opcode, payload=''):
+    '''Frame a payload the way a browser does, masked'''
+    mask = os.urandom(4)
+    masked = ''.join(
+        chr(ord(c) ^ ord(mask[i % 4])) for i, c in enumerate(payload)
+    )
+    if len(payload) > 0x7d:
+        length = chr(0x80 | 0x7e) + pack('>H', len(payload))
+    else:
+        length = chr(0x80 | len(payload))
+    return chr(0x80 | opcode) + length + mask + masked
+
+
+class Client(object):
+    def __init__(self, server):
+        self.sock = socket.create_connection(('localhost', server.port))
+        self.sock.settimeout(5)
+        self.sock.send(HANDSHAKE)
+        self.buffer = ''
+        while '\r\n\r\n' not in self.buffer:
+            self.buffer += self.sock.recv(4096)
+        self.response, self.buffer = self.buffer.split('\r\n\r\n', 1)
+
+    def read(self):
+        while True:
+            read = read_frame(self.buffer)
+            if read is not None:
+                opcode, payload, self.buffer = read
+                return opcode, payload
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+
+    def send(self, opcode, payload=''):
+        self.sock.send(client_frame(opcode, payload))
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@fixture
+def server(request):
+    server = SocketServer(port=0).start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+class TestFrames(object):
+    def test_round_trip(self):
+        for payload in ['', 'update', 'x' * 200, 'x' * 70000]:
+            assert read_frame(frame(OPCODE_TEXT, payload)) == (
+                OPCODE_TEXT, payload, ''
+            )
+
+    def test_masked_frames(self):
+        data = client_frame(OPCODE_TEXT, 'hello') + 'rest'
+        assert read_frame(data) == (OPCODE_TEXT, 'hello', 'rest')
+
+    def test_incomplete_frames(self):
+        data = client_frame(OPCODE_TEXT, 'x' * 200)
+        for end in range(len(data)):
+            assert read_frame(data[:end]) is None
+
+
+class TestPageUrl(object):
+    def test_page_urls(self):
+        assert page_url('/') == '/'
+        assert page_url('/index.html') == '/'
+        assert page_url('/blog/') == '/blog'
+        assert page_url('/blog/index.html') == '/blog'
+        assert page_url('/blog/post.html') == '/blog/post'
+
+
+class TestSocketServer(object):
+    def test_handshake(self, server):
+        client = Client(server)
+        assert client.response.startswith('HTTP/1.1 101')
+        assert 's3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in client.response
+
+    def test_broadcasts_to_every_client(self, server):
+        clients = [Client(server) for _ in range(5)]
+        assert wait_for(lambda: len(server.clients) == 5)
+        server.broadcast('update')
+        server.broadcast('again')
+        for client in clients:
+            assert client.read() == (OPCODE_TEXT, 'update')
+            assert client.read() == (OPCODE_TEXT, 'again')
+
+    def test_keeps_clients_between_messages(self, server):
+        client = Client(server)
+        assert wait_for(lambda: len(server.clients) == 1)
+        server.broadcast('update')
+        assert client.read() == (OPCODE_TEXT, 'update')
+        server.broadcast('update')
+        assert client.read() == (OPCODE_TEXT, 'update')
+
+    def test_drops_closed_clients(self, server):
+        client = Client(server)
+        assert wait_for(lambda: len(server.clients) == 1)
+        client.send(OPCODE_CLOSE)
+        assert wait_for(lambda: not server.clients)
+
+        client = Client(server)
+        assert wait_for(lambda: len(server.clients) == 1)
+        client.sock.close()
+        assert wait_for(lambda: not server.clients)
+
+    def test_answers_pings(self, server):
+        client = Client(server)
+        client.send(OPCODE_PING, 'hi')
+        assert client.read() == (OPCODE_PONG, 'hi')
+
+    def test_pings_and_drops_dead_clients(self):
+        server = SocketServer(port=0)
+        server.ping_interval = 0.05
+        server.start()
+        try:
+            client = Client(server)
+            assert client.read() == (OPCODE_PING, '')
+            assert wait_for(lambda: not server.clients)
+        finally:
+            server.stop()
+
+    def test_drops_slow_clients(self, server):
+        server.max_buffer = 10
+        client = Client(server)
+        assert wait_for(lambda: len(server.clients) == 1)
+        server.broadcast('x' * 20)
+        assert wait_for(lambda: not server.clients)
+        client.sock.close()
+
+    def test_registers_page_urls(self, server):
+        client = Client(server)
+        client.send(OPCODE_TEXT, '{"url": "/blog/index.html"}')
+        assert wait_for(
+            lambda: [c.url for c in server.clients] == ['/blog']
+        )
+
+    def test_ignores_unexpected_messages(self, server):
+        client = Client(server)
+        client.send(OPCODE_TEXT, 'hello')
+        client.send(OPCODE_PING)
+        assert client.read() == (OPCODE_PONG, '')
+        assert [c.url for c in server.clients] == [None]
+
+    def test_broadcasts_to_clients_showing_urls(self, server):
+        home, post = Client(server), Client(server)
+        home.send(OPCODE_TEXT, '{"url": "/"}')
+        post.send(OPCODE_TEXT, '{"url": "/blog/post"}')
+        urls = set(['/', '/blog/post'])
+        assert wait_for(lambda: set(c.url for c in server.clients) == urls)
+        server.broadcast('post', urls=['/blog/post'])
+        server.broadcast('all')
+        assert post.read() == (OPCODE_TEXT, 'post')
+        assert post.read() == (OPCODE_TEXT, 'all')
+        assert home.read() == (OPCODE_TEXT, 'all')
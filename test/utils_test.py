@@ -0,0 +1,134 @@
+import os
+
+from pytest import fixture, raises
+
+import staticpy.utils
+from staticpy.utils import DirectoryIndex, write_to_file
+
+
+class TestWriteToFile(object):
+    def test_writes_new_file(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        assert write_to_file(path, 'contents')
+        assert tmpdir.join('page.html').read() == 'contents'
+
+    def test_skips_unchanged_file(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'contents')
+        os.utime(path, (0, 0))
+
+        assert not write_to_file(path, 'contents')
+        assert os.path.getmtime(path) == 0
+
+    def test_replaces_changed_file(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'contents')
+
+        assert write_to_file(path, u'new contents')
+        assert tmpdir.join('page.html').read() == 'new contents'
+
+    def test_writes_chunks(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        assert write_to_file(path, iter(['a', u'b', 'c']), chunk_size=2)
+        assert tmpdir.join('page.html').read() == 'abc'
+
+    def test_skips_unchanged_chunks(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'abcdef')
+        assert not write_to_file(path, ['ab', 'cd', 'ef'], chunk_size=1)
+
+    def test_replaces_file_that_changes_part_way(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'abcdef')
+        assert write_to_file(path, ['ab', 'cd', 'xy'], chunk_size=1)
+        assert tmpdir.join('page.html').read() == 'abcdxy'
+
+    def test_replaces_longer_file(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'abcdef')
+        assert write_to_file(path, ['ab', 'cd'], chunk_size=1)
+        assert tmpdir.join('page.html').read() == 'abcd'
+
+    def test_replaces_shorter_file(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'abcd')
+        assert write_to_file(path, ['ab', 'cd', 'ef'], chunk_size=1)
+        assert tmpdir.join('page.html').read() == 'abcdef'
+
+    def test_leaves_no_temporary_files_on_errors(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+
+        def chunks():
+            yield 'a'
+            raise ValueError()
+
+        with raises(ValueError):
+            write_to_file(path, chunks(), chunk_size=1)
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_leaves_no_temporary_files(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'contents')
+        write_to_file(path, 'new contents')
+        assert os.listdir(str(tmpdir)) == ['page.html']
+
+    def test_new_files_follow_the_umask(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(staticpy.utils, '_UMASK', 0o027)
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'contents')
+        assert os.stat(path).st_mode & 0o777 == 0o640
+
+    def test_replaced_files_keep_their_mode(self, tmpdir):
+        path = str(tmpdir.join('page.html'))
+        write_to_file(path, 'contents')
+        os.chmod(path, 0o600)
+        write_to_file(path, 'new contents')
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+class TestDirectoryIndex(object):
+    @fixture
+    def tree(self, tmpdir):
+        tmpdir.join('index.page').write('')
+        tmpdir.join('a', 'page.page').write('page', ensure=True)
+        tmpdir.join('a', 'b', 'page.page').write('', ensure=True)
+        tmpdir.join('c', 'page.page').write('', ensure=True)
+        return tmpdir
+
+    def test_directories(self, tree):
+        index = DirectoryIndex(str(tree))
+        assert sorted(index.directories(str(tree))) == [
+            str(tree.join('a')),
+            str(tree.join('c')),
+        ]
+        assert index.directories(str(tree.join('a'))) == [
+            str(tree.join('a', 'b')),
+        ]
+
+    def test_files(self, tree):
+        index = DirectoryIndex(str(tree))
+        assert index.files(str(tree)) == [str(tree.join('index.page'))]
+        assert index.files(str(tree.join('a', 'b'))) == [
+            str(tree.join('a', 'b', 'page.page')),
+        ]
+
+    def test_walk(self, tree):
+        index = DirectoryIndex(str(tree))
+        assert len(list(index.walk())) == 4
+
+    def test_threaded_walk_matches(self, tree):
+        index = DirectoryIndex(str(tree))
+        threaded = DirectoryIndex(str(tree), threads=4)
+        assert sorted(index.walk()) == sorted(threaded.walk())
+
+    def test_stat(self, tree):
+        index = DirectoryIndex(str(tree))
+        assert index.stat(str(tree.join('a', 'page.page'))).st_size == 4
+
+    def test_forget_takes_the_stat_again(self, tree):
+        index = DirectoryIndex(str(tree))
+        path = str(tree.join('a', 'page.page'))
+        index.stat(path)
+        tree.join('a', 'page.page').write('longer')
+        index.forget(path)
+        assert index.stat(path).st_size == 6
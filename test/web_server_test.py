@@ -0,0 +1,222 @@
+import os
+import time
+import socket
+import hashlib
+import httplib
+import threading
+
+from pytest import fixture
+
+from staticpy.compression import Compressor
+from staticpy import web_server
+
+
+class FakePage(object):
+    no_render = False
+
+    def __init__(self, url, output_path):
+        self.url = url
+        self.output_path = output_path
+
+
+class FakeSite(object):
+    def __init__(self, root):
+        self.pages = [
+            FakePage('/', os.path.join(root, 'index.html')),
+            FakePage('/blog', os.path.join(root, 'blog', 'index.html')),
+            FakePage('/blog/post', os.path.join(root, 'blog', 'post.html')),
+        ]
+
+
+def write(path, contents):
+    with open(path, 'w') as fp:
+        fp.write(contents)
+
+
+@fixture
+def root(tmpdir):
+    path = str(tmpdir.join('output'))
+    os.makedirs(os.path.join(path, 'blog'))
+    os.makedirs(os.path.join(path, 'static'))
+    write(os.path.join(path, 'index.html'), 'home')
+    write(os.path.join(path, 'blog', 'index.html'), 'blog')
+    write(os.path.join(path, 'blog', 'post.html'), 'post')
+    write(os.path.join(path, 'static', 'site.css'), 'body {}')
+    return path
+
+
+@fixture
+def routes(root):
+    routes = web_server.Routes(root)
+    routes.update(FakeSite(root))
+    return routes
+
+
+@fixture
+def server(request, routes):
+    server = web_server.TestServer(
+        ('127.0.0.1', 0),
+        web_server.TestHandler,
+        routes,
+    )
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+def connect(server):
+    return httplib.HTTPConnection(*server.server_address, timeout=5)
+
+
+def get(connection, path, headers=None):
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+class TestRoutes(object):
+    def test_pages(self, root, routes):
+        assert routes.resolve('/') == os.path.join(root, 'index.html')
+        assert routes.resolve('/blog/post') == os.path.join(
+            root, 'blog', 'post.html'
+        )
+
+    def test_category_index(self, root, routes):
+        index = os.path.join(root, 'blog', 'index.html')
+        assert routes.resolve('/blog') == index
+        assert routes.resolve('/blog/') == index
+
+    def test_query_string(self, root, routes):
+        assert routes.resolve('/blog/post?a=1') == os.path.join(
+            root, 'blog', 'post.html'
+        )
+
+    def test_files(self, root, routes):
+        assert routes.resolve('/static/site.css') == os.path.join(
+            root, 'static', 'site.css'
+        )
+
+    def test_stays_in_root(self, root, routes):
+        assert routes.resolve('/../../etc/passwd') == os.path.join(
+            root, 'etc', 'passwd'
+        )
+
+
+class TestServing(object):
+    def test_serves_pages_and_files(self, server):
+        connection = connect(server)
+        assert get(connection, '/')[1] == 'home'
+        assert get(connection, '/blog/post')[1] == 'post'
+        assert get(connection, '/static/site.css')[1] == 'body {}'
+
+    def test_missing_file(self, server):
+        response, _ = get(connect(server), '/missing')
+        assert response.status == 404
+
+    def test_keeps_connections_alive(self, server):
+        connection = connect(server)
+        get(connection, '/')
+        sock = connection.sock
+        get(connection, '/blog')
+        assert connection.sock is sock
+
+    def test_slow_clients_do_not_block(self, server):
+        slow = socket.create_connection(server.server_address)
+        slow.send('GET / HTTP/1.1\r\n')
+        try:
+            assert get(connect(server), '/')[1] == 'home'
+        finally:
+            slow.close()
+
+    def test_redirects_directories(self, server):
+        connection = connect(server)
+        response, _ = get(connection, '/static?a=1')
+        assert response.status == 301
+        assert response.getheader('Location') == '/static/?a=1'
+        assert response.getheader('Content-Length') == '0'
+        assert get(connection, '/')[1] == 'home'
+
+    def test_serves_compressed_copies(self, root, server):
+        write(os.path.join(root, 'static', 'site.css'), 'body {}' * 1000)
+        Compressor(root).compress()
+        response, body = get(
+            connect(server),
+            '/static/site.css',
+            {'Accept-Encoding': 'gzip'},
+        )
+        assert response.getheader('Content-Encoding') == 'gzip'
+        assert response.getheader('Content-Type') == 'text/css'
+        assert body.startswith('\x1f\x8b')
+
+
+class TestConditionalGet(object):
+    def test_cache_headers(self, server):
+        response, _ = get(connect(server), '/static/site.css')
+        assert response.getheader('Cache-Control') == 'no-cache'
+        assert response.getheader('ETag')
+        assert response.getheader('Last-Modified')
+
+    def test_etag_is_the_content_hash(self, server):
+        response, _ = get(connect(server), '/')
+        md5 = hashlib.md5('home').hexdigest()
+        assert response.getheader('ETag') == '"%s"' % md5
+
+    def test_if_none_match(self, server):
+        connection = connect(server)
+        response, _ = get(connection, '/static/site.css')
+        etag = response.getheader('ETag')
+        response, body = get(connection, '/static/site.css', {
+            'If-None-Match': etag,
+        })
+        assert response.status == 304
+        assert body == ''
+        assert response.getheader('ETag') == etag
+
+    def test_changed_files_are_sent(self, root, server):
+        connection = connect(server)
+        response, _ = get(connection, '/')
+        etag = response.getheader('ETag')
+        write(os.path.join(root, 'index.html'), 'new home')
+        response, body = get(connection, '/', {'If-None-Match': etag})
+        assert response.status == 200
+        assert body == 'new home'
+
+    def test_if_modified_since(self, root, server):
+        connection = connect(server)
+        response, _ = get(connection, '/')
+        modified = response.getheader('Last-Modified')
+        response, _ = get(connection, '/', {'If-Modified-Since': modified})
+        assert response.status == 304
+
+        later = time.time() + 10
+        os.utime(os.path.join(root, 'index.html'), (later, later))
+        response, _ = get(connection, '/', {'If-Modified-Since': modified})
+        assert response.status == 200
+
+    def test_compressed_copies_have_their_own_etag(self, root, server):
+        write(os.path.join(root, 'static', 'site.css'), 'body {}' * 1000)
+        Compressor(root).compress()
+        connection = connect(server)
+        plain, _ = get(connection, '/static/site.css')
+        gzipped, _ = get(connection, '/static/site.css', {
+            'Accept-Encoding': 'gzip',
+        })
+        assert plain.getheader('ETag') != gzipped.getheader('ETag')
+
+
+class TestETags(object):
+    def test_uses_build_hashes(self, root, monkeypatch):
+        path = os.path.join(root, 'static', 'site.css')
+        write(path, 'body {}' * 1000)
+        Compressor(root).compress()
+        etags = web_server.ETags()
+        etags.update(root)
+
+        def file_hash(path):
+            raise AssertionError('hashed %s' % path)
+
+        monkeypatch.setattr('staticpy.web_server.file_hash', file_hash)
+        md5 = hashlib.md5('body {}' * 1000).hexdigest()
+        assert etags.get(path, os.stat(path)) == md5